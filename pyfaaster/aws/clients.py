@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Process wide registry of boto3 clients. Building a client costs several milliseconds and a fresh
+HTTP connection pool, so warm lambda invocations should reuse the clients of earlier invocations.
+"""
+
+import os
+import threading
+
+import boto3
+
+import pyfaaster.aws.deadline as deadline
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _key(service_name, region_name, config, kwargs):
+    region = region_name or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+    # botocore Config objects are not hashable; their user provided options identify them
+    config_key = repr(sorted(config._user_provided_options.items())) if config else None
+    return service_name, region, config_key, tuple(sorted(kwargs.items()))
+
+
+def client(service_name, region_name=None, config=None, **kwargs):
+    """
+    Return a boto3 client for `service_name`, creating it on first use. Clients are keyed by
+    service, region, config and any explicit credentials / endpoint passed in kwargs, so callers
+    asking for the same client share it (and its connection pool) across invocations.
+
+    Within a deadline (see deadline.scope), the client's connect and read timeouts are limited to
+    what is left of the invocation's budget.
+
+    Args:
+        service_name (str): boto3 service name, e.g. 's3'
+        region_name (str): optional region; defaults to the region of the environment
+        config (botocore.config.Config): optional client configuration
+        kwargs: other boto3.client arguments, e.g. endpoint_url, aws_access_key_id, aws_session_token
+
+    Returns:
+        a (shared) boto3 client
+    """
+    timeouts = deadline.client_config()
+    if timeouts:
+        config = config.merge(timeouts) if config else timeouts
+
+    key = _key(service_name, region_name, config, kwargs)
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+
+    # boto3's default session is not thread safe, so creation is serialized
+    with _lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(service_name, region_name=region_name, config=config, **kwargs)
+        return _clients[key]
+
+
+def invalidate(service_name=None):
+    """
+    Drop cached clients, e.g. after credentials have been rotated. With no `service_name` every
+    client is dropped and boto3's default session is reset, so credentials are resolved again.
+
+    Args:
+        service_name (str): optionally only drop clients for this service
+    """
+    with _lock:
+        for key in [k for k in _clients if service_name in (None, k[0])]:
+            del _clients[key]
+        if service_name is None:
+            boto3.DEFAULT_SESSION = None
@@ -4,22 +4,47 @@
 
 from cachetools import cached, LRUCache
 from cachetools.keys import hashkey
-import io
-
-import boto3
-import simplejson as json
+import collections
+import copy
+import time
 
+import pyfaaster.aws.clients as clients
 import pyfaaster.aws.tools as tools
+import pyfaaster.common.serialization as serialization
 
 logger = tools.setup_logging('pyfaaster')
 
 
-def load(conn, config_bucket, config_file):
-    logger.info(f'Reading configuration from {config_bucket}/{config_file}.')
-    content_object = conn['client'].get_object(Bucket=config_bucket, Key=config_file)
+DEFAULT_CACHE_TTL = 60
+
+# (config_bucket, config_file) -> {'settings': dict, 'etag': str, 'checked': float}
+settings_cache = {}
+cache_stats = collections.Counter(hits=0, misses=0, revalidations=0)
+
+
+def _get(conn, config_bucket, config_file, **kwargs):
+    content_object = conn['client'].get_object(Bucket=config_bucket, Key=config_file, **kwargs)
     file_content = content_object['Body'].read().decode('utf-8')
+    return serialization.loads(file_content), content_object.get('ETag')
+
+
+def _not_modified(error):
+    response = getattr(error, 'response', None) or {}
+    return (response.get('Error', {}).get('Code') in ('304', 'NotModified') or
+            response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304)
+
+
+def _cache(config_bucket, config_file, settings, etag):
+    settings_cache[(config_bucket, config_file)] = {
+        'settings': copy.deepcopy(settings),
+        'etag': etag,
+        'checked': time.monotonic(),
+    }
+
 
-    settings = json.loads(file_content)
+def load(conn, config_bucket, config_file):
+    logger.info(f'Reading configuration from {config_bucket}/{config_file}.')
+    settings, _ = _get(conn, config_bucket, config_file)
     logger.debug('loaded settings')
     return settings
 
@@ -28,10 +53,12 @@ def save(conn, config_bucket, config_file, settings):
     logger.info(f'Saving configuration to {config_bucket}/{config_file}.')
     encryption = {'ServerSideEncryption': 'aws:kms', 'SSEKMSKeyId': conn['encrypt_key_arn']} if conn[
         'encrypt_key_arn'] else {'ServerSideEncryption': 'AES256'}
-    conn['client'].put_object(Bucket=config_bucket,
-                              Key=config_file,
-                              Body=io.StringIO(json.dumps(settings)).read(),
-                              **encryption)
+    response = conn['client'].put_object(Bucket=config_bucket,
+                                         Key=config_file,
+                                         Body=serialization.dumps(settings),
+                                         **encryption)
+    # keep the warm container cache in step with our own writes
+    _cache(config_bucket, config_file, settings, (response or {}).get('ETag'))
     return settings
 
 
@@ -44,9 +71,59 @@ def load_or_create(conn, config_bucket, config_file):
         return save(conn, config_bucket, config_file, {})
 
 
+def load_cached(conn, config_bucket, config_file, ttl=DEFAULT_CACHE_TTL, create=False):
+    """ Load configuration through a cache that lives as long as the (warm) container. Entries
+    younger than `ttl` seconds are served from memory; older entries are revalidated with a
+    conditional GetObject (IfNoneMatch on the stored ETag), so an unchanged file costs a 304
+    instead of a full download and parse. Writes made via `save` update the cache.
+
+    Args:
+        conn (dict): configuration connection, see `conn`
+        config_bucket (str): S3 bucket holding the configuration file
+        config_file (str): S3 key of the configuration file
+        ttl (int|float): seconds an entry is trusted without revalidation; 0 revalidates every call
+        create (bool): create an empty configuration file if absent
+
+    Returns:
+        dict: a copy of the cached settings
+    """
+    entry = settings_cache.get((config_bucket, config_file))
+    if entry and time.monotonic() - entry['checked'] < ttl:
+        cache_stats['hits'] += 1
+        return copy.deepcopy(entry['settings'])
+
+    conditions = {'IfNoneMatch': entry['etag']} if entry and entry['etag'] else {}
+    try:
+        logger.info(f'Reading configuration from {config_bucket}/{config_file} ({"revalidate" if conditions else "miss"}).')
+        settings, etag = _get(conn, config_bucket, config_file, **conditions)
+    except Exception as error:
+        if conditions and _not_modified(error):
+            cache_stats['revalidations'] += 1
+            entry['checked'] = time.monotonic()
+            return copy.deepcopy(entry['settings'])
+        if not create:
+            raise
+        logger.info(f'Failed to load, attempting to create {config_bucket}/{config_file} ({error}')
+        cache_stats['misses'] += 1
+        return save(conn, config_bucket, config_file, {})
+
+    cache_stats['misses'] += 1
+    _cache(config_bucket, config_file, settings, etag)
+    return settings
+
+
+def invalidate(config_bucket=None, config_file=None):
+    """ Drop cached configuration entries. With no arguments the whole cache is cleared,
+    otherwise only the entries matching the given bucket and/or file.
+    """
+    for bucket, file in list(settings_cache):
+        if config_bucket in (None, bucket) and config_file in (None, file):
+            del settings_cache[(bucket, file)]
+
+
 def conn(encrypt_key_arn=None, client=None):
     return {
-        'client': client or boto3.client('s3'),
+        'client': client or clients.client('s3'),
         'encrypt_key_arn': encrypt_key_arn,
     }
 
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+The deadline of the current lambda invocation (see handlers_decorators_v2.deadline_aware). While one
+is set, clients.client hands out clients whose timeouts fit in the remaining time, so that a slow
+AWS call fails (cleanly) instead of running into the lambda timeout.
+"""
+
+import contextlib
+import contextvars
+import signal
+import threading
+import time
+
+from botocore.config import Config
+
+from pyfaaster.aws.exceptions import HTTPResponseException
+
+DEFAULT_RESERVE_MS = 500
+
+# Client timeouts are rounded down to one of these (seconds), so only a few clients per service are created
+TIMEOUT_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+_current = contextvars.ContextVar('pyfaaster_deadline', default=None)
+
+
+class DeadlineExceededException(HTTPResponseException):
+    """Raised when the remaining time of an invocation drops below its reserve; a 503 for http_response."""
+
+    def __init__(self, body='Request timed out.', statusCode=503):
+        super().__init__(body, statusCode=statusCode)
+
+
+class Deadline:
+    """The time by which an invocation must be done, less a reserve to return a response."""
+
+    __slots__ = ('at', 'reserve_ms')
+
+    def __init__(self, remaining_ms, reserve_ms=DEFAULT_RESERVE_MS):
+        self.at = time.monotonic() + remaining_ms / 1000
+        self.reserve_ms = reserve_ms
+
+    def remaining_ms(self):
+        """Milliseconds left before the lambda times out."""
+        return max(0, (self.at - time.monotonic()) * 1000)
+
+    def budget_ms(self):
+        """Milliseconds left before the reserve."""
+        return max(0, self.remaining_ms() - self.reserve_ms)
+
+    def expired(self):
+        return self.budget_ms() <= 0
+
+    def check(self):
+        """ Raise DeadlineExceededException if there is no time left before the reserve. """
+        if self.expired():
+            raise DeadlineExceededException()
+
+
+def from_context(context, reserve_ms=DEFAULT_RESERVE_MS):
+    """ The Deadline of a lambda context, or None if it has no get_remaining_time_in_millis. """
+    get_remaining_time_in_millis = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time_in_millis is None:
+        return None
+    return Deadline(get_remaining_time_in_millis(), reserve_ms)
+
+
+def current():
+    """The Deadline of the current invocation, or None."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def scope(deadline):
+    """ Make `deadline` the current one for the duration of the block. """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def alarm(deadline):
+    """ Raise DeadlineExceededException in the block when the deadline's budget runs out, using
+    SIGALRM. Only possible in the main thread (where lambda runs handlers); elsewhere a no-op.
+    """
+    if deadline is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise DeadlineExceededException()
+
+    deadline.check()
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, deadline.budget_ms() / 1000)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def client_config():
+    """ botocore Config with connect and read timeouts that fit the current deadline's budget
+    (rounded down to TIMEOUT_BUCKETS), or None without a deadline. Timeouts apply per attempt.
+    """
+    deadline = current()
+    if deadline is None:
+        return None
+    budget = deadline.budget_ms() / 1000
+    timeout = max([b for b in TIMEOUT_BUCKETS if b <= budget] or [TIMEOUT_BUCKETS[0]])
+    return Config(connect_timeout=timeout, read_timeout=timeout)
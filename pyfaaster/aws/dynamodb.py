@@ -2,16 +2,85 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import queue
+import random
 import re
+import threading
+import time
 from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
 
+import pyfaaster.aws.clients as clients
+import pyfaaster.aws.tools as tools
+
+logger = tools.setup_logging('pyfaaster')
+
 pattern = re.compile(r'[\W_]+', re.UNICODE)
 
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 0.05
+BATCH_CONCURRENCY = 4
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+class BatchException(Exception):
+    def __init__(self, message, unprocessed) -> None:
+        super().__init__(message, unprocessed)
+        self.unprocessed = unprocessed
+
+
+def serialize_item(item):
+    """
+    Serialize a python dict into a DynamoDB item (attribute name -> typed attribute value).
+    Args:
+        item (dict):
+
+    Returns:
+        dict
+    """
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize_item(item):
+    """
+    Deserialize a DynamoDB item (attribute name -> typed attribute value) into a python dict.
+    Args:
+        item (dict):
+
+    Returns:
+        dict
+    """
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+
+@functools.lru_cache(maxsize=1024)
+def _update_template(attribute_names):
+    # Placeholders are alphanumeric versions of the attribute names, made unique if they collide
+    placeholders = {}
+    for name in sorted(attribute_names):
+        placeholder = pattern.sub("", name)
+        while placeholder in placeholders.values():
+            placeholder = f'{placeholder}_'
+        placeholders[name] = placeholder
+
+    updates_string = ', '.join([f'#{p} = :{p}' for p in placeholders.values()])
+    update_expression = f'SET {updates_string}'
+    expression_names = {f'#{p}': name for name, p in placeholders.items()}
+    value_placeholders = tuple((name, f':{p}') for name, p in placeholders.items())
+    return update_expression, expression_names, value_placeholders
+
 
 def update_item_from_dict(table_name, key, dictionary, client):
     """
     Update the item identified by `key` in the DynamoDB `table` by adding
     all of the attributes in the `dictionary`.
+
+    The update expression for a set of attribute names is built once and cached, so repeated
+    updates of the same attributes only serialize the values.
     Args:
         table_name (str):
         key (dict):
@@ -21,29 +90,257 @@ def update_item_from_dict(table_name, key, dictionary, client):
     Returns:
         dict
     """
-    serializer = TypeSerializer()
-    deserializer = TypeDeserializer()
-
-    # Prepare data by generating an alphanumeric version of the key
-    working_data = {k: [pattern.sub("", k), v] for k, v in dictionary.items()}
-
-    updates_string = ', '.join([f'#{v[0]} = :{v[0]}' for v in working_data.values()])
-    update_expression = f'SET {updates_string}'
-    attribute_names = {f'#{v[0]}': k for k, v in working_data.items()}
-    attribute_values = {f':{v[0]}': serializer.serialize(v[1]) for k, v in working_data.items()}
+    update_expression, attribute_names, value_placeholders = _update_template(frozenset(dictionary))
+    attribute_values = {placeholder: serializer.serialize(dictionary[name]) for name, placeholder in value_placeholders}
     item = client.update_item(
         TableName=table_name,
-        Key={k: serializer.serialize(v) for k, v in key.items()},
+        Key=serialize_item(key),
         UpdateExpression=update_expression,
-        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeNames=dict(attribute_names),
         ExpressionAttributeValues=attribute_values,
         ReturnValues='ALL_NEW',
     )
     if item:
-        result_data = item.get('Attributes', {})
-        output_data = {}
-        for k, v in result_data.items():
-            output_data[k] = deserializer.deserialize(v)
-        return output_data
+        return deserialize_item(item.get('Attributes', {}))
     else:
         return None
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, BATCH_BACKOFF * 2 ** attempt))
+
+
+def _run_chunks(run_chunk, chunks, max_concurrency):
+    if not max_concurrency or max_concurrency < 2 or len(chunks) < 2:
+        return [run_chunk(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks))) as executor:
+        return list(executor.map(run_chunk, chunks))
+
+
+def _write_chunk(client, table_name, requests):
+    pending = {table_name: requests}
+    for attempt in range(BATCH_RETRIES + 1):
+        pending = client.batch_write_item(RequestItems=pending).get('UnprocessedItems') or {}
+        if not pending.get(table_name):
+            return []
+        if attempt < BATCH_RETRIES:
+            logger.warning(f'Retrying {len(pending[table_name])} of {len(requests)} writes to {table_name}')
+            _backoff(attempt)
+    return pending[table_name]
+
+
+def batch_put_items(table_name, items, client=None, max_concurrency=BATCH_CONCURRENCY):
+    """
+    Put `items` into the DynamoDB table with BatchWriteItem, 25 items per request, running up to
+    `max_concurrency` requests at a time. Unprocessed items are retried with jittered backoff.
+    An item must not appear twice in the same request, so keys should be unique.
+    Args:
+        table_name (str):
+        items (list): plain python dicts
+        client: DynamoDB client; defaults to the shared one, see clients.client
+        max_concurrency (int): maximum concurrent requests; 1 to write sequentially
+
+    Returns:
+        int: number of items written
+
+    Raises:
+        BatchException: with the items (as dicts) still unprocessed after retrying
+    """
+    client = client or clients.client('dynamodb')
+    requests = [{'PutRequest': {'Item': serialize_item(item)}} for item in items]
+    results = _run_chunks(lambda chunk: _write_chunk(client, table_name, chunk),
+                          _chunks(requests, BATCH_WRITE_SIZE), max_concurrency)
+
+    unprocessed = [deserialize_item(r['PutRequest']['Item']) for result in results for r in result]
+    if unprocessed:
+        raise BatchException(f'Failed to write {len(unprocessed)} items to {table_name}.', unprocessed)
+    return len(requests)
+
+
+def _get_chunk(client, table_name, keys, request):
+    items = []
+    pending = {table_name: {**request, 'Keys': keys}}
+    for attempt in range(BATCH_RETRIES + 1):
+        response = client.batch_get_item(RequestItems=pending)
+        items.extend(response.get('Responses', {}).get(table_name, []))
+        pending = response.get('UnprocessedKeys') or {}
+        if not pending.get(table_name):
+            return items, []
+        if attempt < BATCH_RETRIES:
+            logger.warning(f'Retrying {len(pending[table_name]["Keys"])} of {len(keys)} reads from {table_name}')
+            _backoff(attempt)
+    return items, pending[table_name]['Keys']
+
+
+def batch_get_items(table_name, keys, client=None, max_concurrency=BATCH_CONCURRENCY, consistent_read=False,
+                    projection=None):
+    """
+    Get the items with the given `keys` from the DynamoDB table with BatchGetItem, 100 keys per
+    request, running up to `max_concurrency` requests at a time. Unprocessed keys are retried with
+    jittered backoff. Duplicate keys are only read once.
+    Args:
+        table_name (str):
+        keys (list): plain python dicts, e.g. [{'id': '1'}, {'id': '2'}]
+        client: DynamoDB client; defaults to the shared one, see clients.client
+        max_concurrency (int): maximum concurrent requests; 1 to read sequentially
+        consistent_read (bool):
+        projection (str): optional ProjectionExpression
+
+    Returns:
+        list: the items found, as dicts, in no particular order
+
+    Raises:
+        BatchException: with the keys (as dicts) still unprocessed after retrying
+    """
+    client = client or clients.client('dynamodb')
+    unique = {}
+    for key in keys:
+        serialized = serialize_item(key)
+        unique.setdefault(repr(sorted(serialized.items())), serialized)
+
+    request = {'ConsistentRead': consistent_read}
+    if projection:
+        request['ProjectionExpression'] = projection
+    results = _run_chunks(lambda chunk: _get_chunk(client, table_name, chunk, request),
+                          _chunks(list(unique.values()), BATCH_GET_SIZE), max_concurrency)
+
+    unprocessed = [deserialize_item(key) for _, result in results for key in result]
+    if unprocessed:
+        raise BatchException(f'Failed to read {len(unprocessed)} items from {table_name}.', unprocessed)
+    return [deserialize_item(item) for items, _ in results for item in items]
+
+
+def _throttle(items_per_second):
+    # Spaces out requests so that, on average, no more than items_per_second items are read,
+    # however many threads share it
+    if not items_per_second:
+        return lambda count: None
+    lock = threading.Lock()
+    state = {'available_at': time.monotonic()}
+
+    def wait(count):
+        with lock:
+            now = time.monotonic()
+            start = max(now, state['available_at'])
+            state['available_at'] = start + count / items_per_second
+        if start > now:
+            time.sleep(start - now)
+
+    return wait
+
+
+def _pages(call, request, throttle):
+    while True:
+        response = call(**request)
+        items = response.get('Items', [])
+        yield [deserialize_item(item) for item in items]
+        if not response.get('LastEvaluatedKey'):
+            return
+        throttle(len(items))
+        request = {**request, 'ExclusiveStartKey': response['LastEvaluatedKey']}
+
+
+def _request(table_name, values, kwargs):
+    request = {'TableName': table_name, **kwargs}
+    if values:
+        request['ExpressionAttributeValues'] = serialize_item(values)
+    return request
+
+
+def query_items(table_name, key_condition, values=None, client=None, items_per_second=None, **kwargs):
+    """
+    Query the DynamoDB table, yielding the items (as dicts) one page at a time, so that memory
+    use does not grow with the size of the result.
+
+    E.g., query_items('table', '#pk = :pk', {':pk': 'a'}, ExpressionAttributeNames={'#pk': 'pk'})
+    Args:
+        table_name (str):
+        key_condition (str): KeyConditionExpression
+        values (dict): ExpressionAttributeValues, as plain python values
+        client: DynamoDB client; defaults to the shared one, see clients.client
+        items_per_second (float): optional limit on the read rate
+        kwargs: other Query arguments, e.g. IndexName, FilterExpression, ExpressionAttributeNames,
+            ProjectionExpression, ScanIndexForward, Limit (the page size)
+
+    Returns:
+        generator: of item dicts
+    """
+    client = client or clients.client('dynamodb')
+    request = _request(table_name, values, {'KeyConditionExpression': key_condition, **kwargs})
+    for page in _pages(client.query, request, _throttle(items_per_second)):
+        yield from page
+
+
+def _scan_segments(client, request, segments, throttle):
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment):
+        try:
+            for page in _pages(client.scan, {**request, 'Segment': segment, 'TotalSegments': segments}, throttle):
+                if not put(page):
+                    return
+            put(done)
+        except Exception as err:
+            put(err)
+
+    executor = ThreadPoolExecutor(max_workers=segments)
+    try:
+        for segment in range(segments):
+            executor.submit(scan_segment, segment)
+        remaining = segments
+        while remaining:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def scan_items(table_name, values=None, client=None, segments=1, items_per_second=None, **kwargs):
+    """
+    Scan the DynamoDB table, yielding the items (as dicts) one page at a time, so that memory use
+    does not grow with the size of the table. With segments > 1 the table is scanned as that many
+    segments (TotalSegments) in parallel, and items are yielded as pages arrive, in no particular
+    order; at most a couple of pages per segment are buffered.
+
+    Args:
+        table_name (str):
+        values (dict): ExpressionAttributeValues, as plain python values
+        client: DynamoDB client; defaults to the shared one, see clients.client
+        segments (int): number of segments to scan in parallel
+        items_per_second (float): optional limit on the read rate, over all segments, to protect
+            the table's provisioned capacity
+        kwargs: other Scan arguments, e.g. FilterExpression, ExpressionAttributeNames,
+            ProjectionExpression, IndexName, Limit (the page size)
+
+    Returns:
+        generator: of item dicts
+    """
+    client = client or clients.client('dynamodb')
+    request = _request(table_name, values, kwargs)
+    throttle = _throttle(items_per_second)
+    if segments > 1:
+        yield from _scan_segments(client, request, segments, throttle)
+    else:
+        for page in _pages(client.scan, request, throttle):
+            yield from page
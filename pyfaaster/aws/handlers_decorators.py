@@ -2,7 +2,6 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
-import functools
 import re
 import os
 
@@ -11,7 +10,9 @@ import simplejson as json
 import pyfaaster.aws.configuration as conf
 from pyfaaster.aws.exceptions import HTTPResponseException
 import pyfaaster.aws.publish as publish
+import pyfaaster.aws.request_context as request_context
 import pyfaaster.aws.tools as tools
+import pyfaaster.common.serialization as serialization
 import pyfaaster.common.utils as utils
 
 
@@ -88,7 +89,7 @@ def allow_origin_response(*origins):
             logger.debug(f'Checking origin for event: {event}')
 
             # Check Origin
-            request_origin = utils.deep_get(event, 'headers', 'origin', ignore_case=True)
+            request_origin = request_context.headers(event).get('origin')
             if not any(re.match(o, str(request_origin)) for o in origins):
                 logger.warning(f'Invalid request origin: {request_origin}')
                 return {'statusCode': 403, 'body': 'Unknown origin.'}
@@ -264,19 +265,19 @@ def http_response(default_error_message=None):
                 return {
                     'headers': res.get('headers', {}),
                     'statusCode': res.get('statusCode', 200),
-                    'body': json.dumps(res['body'], iterable_as_array=True) if 'body' in res else None,
+                    'body': serialization.dumps(res['body']) if 'body' in res else None,
                 }
             except HTTPResponseException as err:
                 return {
                     'statusCode': err.statusCode,
-                    'body': json.dumps(err.body, iterable_as_array=True),
+                    'body': serialization.dumps(err.body),
                 }
             except Exception as err:
                 # Try and handle HTTPResponseException like objects
                 if hasattr(err, 'statusCode') and hasattr(err, 'body'):
                     return {
                         'statusCode': err.statusCode,
-                        'body': json.dumps(err.body, iterable_as_array=True),
+                        'body': serialization.dumps(err.body),
                     }
                 else:
                     logger.exception(err)
@@ -391,20 +392,24 @@ def subscriber(required_topics=None):
     return subscriber_handler
 
 
-def configuration_aware(config_file, create=False):
+def configuration_aware(config_file, create=False, cache_ttl=None, lazy=False):
     """ Decorator that expects a configuration file in an S3 Bucket specified by the 'CONFIG'
     environment variable and S3 Bucket Key (path) specified by config_file. If create=True, this
     decorator will create an empty configuration file instead of erring.
 
-    NOTE: Decorating a lambda with this incurs a performance penalty - S3 is checked on every call.
-          This makes sense when writing a lambda function that updates config and is called infrequently,
-          but makes far less sense if all one needs to do is read config data.
-    TODO: We need a more clear, refined pattern for dealing with uncached writes and cached reads.
-          The way the current config features are written, it's not clear how best to use them.
+    NOTE: Without cache_ttl, S3 is checked on every call. This makes sense when writing a lambda
+          function that updates config and is called infrequently. Read heavy functions should set
+          cache_ttl: the configuration is then kept across invocations of a warm container and, once
+          older than cache_ttl seconds, revalidated with a conditional (ETag) GetObject. Writes through
+          configuration['save'] update the cached entry. Within one invocation the configuration is
+          loaded at most once; after configuration['save'], configuration['load'] returns the saved settings.
 
     Args:
         config_file (str): key in the 'CONFIG' S3 bucket of expected configuration file
         create (Bool): optionally create configuration file if absent
+        cache_ttl (int|float): optionally cache the configuration for this many seconds (see conf.load_cached)
+        lazy (Bool): optionally defer loading until the handler first calls configuration['load'];
+                     handlers that never read configuration then make no S3 calls at all
 
     Returns:
         handler (func): a configuration aware lambda handler
@@ -413,19 +418,42 @@ def configuration_aware(config_file, create=False):
         def handler_wrapper(event, context, **kwargs):
             config_bucket = os.environ['CONFIG']
             encrypt_key_arn = os.environ.get('ENCRYPT_KEY_ARN')
-
-            conn = conf.conn(encrypt_key_arn)
-            try:
-                settings = conf.load_or_create(conn, config_bucket, config_file) if create else conf.load(
-                    conn, config_bucket, config_file)
-            except Exception as err:
-                logger.exception(err)
-                logger.error('Failed to load or create configuration.')
-                return {'statusCode': 503, 'body': 'Failed to load configuration.'}
+            state = {}
+
+            def connection():
+                if 'conn' not in state:
+                    state['conn'] = conf.conn(encrypt_key_arn)
+                return state['conn']
+
+            def load():
+                if 'settings' not in state:
+                    try:
+                        if cache_ttl is not None:
+                            state['settings'] = conf.load_cached(connection(), config_bucket, config_file,
+                                                                 ttl=cache_ttl, create=create)
+                        elif create:
+                            state['settings'] = conf.load_or_create(connection(), config_bucket, config_file)
+                        else:
+                            state['settings'] = conf.load(connection(), config_bucket, config_file)
+                    except Exception as err:
+                        logger.exception(err)
+                        logger.error('Failed to load or create configuration.')
+                        raise HTTPResponseException('Failed to load configuration.', statusCode=503)
+                return state['settings'] or {}
+
+            def save(settings):
+                state['settings'] = conf.save(connection(), config_bucket, config_file, settings)
+                return state['settings']
+
+            if not lazy:
+                try:
+                    load()
+                except HTTPResponseException as err:
+                    return {'statusCode': err.statusCode, 'body': err.body}
 
             configuration = {
-                'load': lambda: settings or {},
-                'save': functools.partial(conf.save, conn, config_bucket, config_file),
+                'load': load,
+                'save': save,
             }
             return handler(event, context, configuration=configuration, **kwargs)
 
@@ -503,11 +531,15 @@ def catch_exceptions(handler):
     return handler_wrapper
 
 
-def default(default_error_message=None):
+def default(default_error_message=None, lazy_configuration=False):
     """
     AWS lambda handler handler. A wrapper with standard boilerplate implementing the
     best practices we've developed
 
+    Args:
+        default_error_message (string): Default message to send if none was provided
+        lazy_configuration (Bool): only load 'configuration.json' when the handler calls configuration['load']
+
     Returns:
         The wrapped lambda function or JSON response function when an error occurs.  When called,
         this wrapped function will return the appropriate output
@@ -518,7 +550,7 @@ def default(default_error_message=None):
         @http_response(default_error_message)
         @account_id_aware
         @client_config_aware
-        @configuration_aware('configuration.json', create=True)
+        @configuration_aware('configuration.json', create=True, lazy=lazy_configuration)
         @environ_aware(['NAMESPACE', 'CONFIG'], ['ENCRYPT_KEY_ARN'])
         @pingable
         def handler_wrapper(event, context, **kwargs):
@@ -1,45 +1,108 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+import base64
+import collections
+import contextvars
 import functools
+import hashlib
 import re
 import os
+import threading
+import time
 
+import cachetools
+from cachetools.keys import hashkey
 import simplejson as json
 
 import pyfaaster.aws.configuration as conf
+import pyfaaster.aws.deadline as deadline
 from pyfaaster.aws.exceptions import HTTPResponseException
+import pyfaaster.aws.idempotency as idempotency
 import pyfaaster.aws.publish as publish
+import pyfaaster.aws.request_context as request_context
 import pyfaaster.aws.tools as tools
+import pyfaaster.common.compression as compression
+import pyfaaster.common.serialization as serialization
 import pyfaaster.common.utils as utils
 
 logger = tools.setup_logging('pyfaaster')
 
+DEFERRED_PUBLISH_RESERVE_MS = 500
+_deferred_publishes = contextvars.ContextVar('pyfaaster_deferred_publishes', default=None)
 
-def environ_aware(required=None, optional=None):
+# The work of each decorator, as hooks that `pipeline` can run without nesting wrappers:
+#   before(event, context, kwargs) -> None to continue (kwargs may be updated) or a response to short circuit
+#   after(event, context, kwargs, response) -> response
+#   error(event, context, err) -> response (only for a pipeline's first step, e.g. http_response)
+Step = collections.namedtuple('Step', ['before', 'after', 'error'], defaults=(None, None, None))
+
+
+_environ_snapshots = []
+
+
+def _environ_step(required=None, optional=None, snapshot=False):
+    def read():
+        values = {}
+        for r in required if required else []:
+            value = os.environ.get(r)
+            if not value:
+                raise HTTPResponseException(f'{r} environment variable missing.')
+            values[r] = value
+
+        for o in optional if optional else []:
+            values[o] = os.environ.get(o)
+        return values
+
+    if not snapshot:
+        def before(event, context, kwargs):
+            kwargs.update(read())
+
+        return Step(before)
+
+    snapshots = {}
+    _environ_snapshots.append(snapshots)
+
+    def snapshot_before(event, context, kwargs):
+        values = snapshots.get('values')
+        if values is None:
+            values = snapshots['values'] = read()
+        kwargs.update(values)
+
+    return Step(snapshot_before)
+
+
+def refresh_environ():
+    """ Drop every environ_aware snapshot, so the next invocation reads (and validates) os.environ again.
+    Useful in tests, or after changing the environment of a warm container.
+    """
+    for snapshots in _environ_snapshots:
+        snapshots.clear()
+
+
+def environ_aware(required=None, optional=None, snapshot=False):
     """ Decorator that will add each environment variable in reqs and opts
     to kwargs. The variables in reqs will be checked for existence
     and throw if the environmental variable is missing.
 
+    Lambda environment variables do not change for the life of a container, so with snapshot=True
+    the variables are read and validated once, on the first successful invocation, and the same
+    values are injected afterwards. Call refresh_environ() to force a re-read. Variables that are
+    toggled at runtime (e.g. PAUSE, see pausable) should not be snapshot.
+
     Args:
         required (iterable): required environment vars
         optional (iterable): optional environment vars
+        snapshot (bool): read the environment once instead of on every invocation
 
     Returns:
         function (func): a function that is environ aware
     """
+    step = _environ_step(required, optional, snapshot)
 
     def environ_handler(handler):
         def function_wrapper(*args, **kwargs):
-            for r in required if required else []:
-                value = os.environ.get(r)
-                if not value:
-                    raise HTTPResponseException(f'{r} environment variable missing.')
-                kwargs[r] = value
-
-            for o in optional if optional else []:
-                kwargs[o] = os.environ.get(o)
-
+            step.before(None, None, kwargs)
             return handler(*args, **kwargs)
 
         return function_wrapper
@@ -50,6 +113,15 @@ def environ_aware(required=None, optional=None):
 namespace_aware = environ_aware(['NAMESPACE'], [])
 
 
+def _domain_aware_before(event, context, kwargs):
+    domain = utils.deep_get(event, 'requestContext', 'authorizer', 'domain')
+    if not domain:
+        logger.error('Domain requestContext variable missing.')
+        raise HTTPResponseException('Invalid domain.')
+
+    kwargs['domain'] = domain
+
+
 def domain_aware(handler):
     """ Decorator that will check and add event.requestContext.authorizer.domain to the event kwargs.
 
@@ -60,17 +132,39 @@ def domain_aware(handler):
         handler (func): a lambda handler function that is domain aware
     """
     def handler_wrapper(event, context, **kwargs):
-        domain = utils.deep_get(event, 'requestContext', 'authorizer', 'domain')
-        if not domain:
-            logger.error('Domain requestContext variable missing.')
-            raise HTTPResponseException('Invalid domain.')
-
-        kwargs['domain'] = domain
+        _domain_aware_before(event, context, kwargs)
         return handler(event, context, **kwargs)
 
     return handler_wrapper
 
 
+def _allow_origin_step(*origins):
+    def before(event, context, kwargs):
+        logger.debug(f'Checking origin for event: {event}')
+
+        # Check Origin
+        request_origin = request_context.headers(event).get('origin')
+        if not any(re.match(o, str(request_origin)) for o in origins):
+            logger.warning(f'Invalid request origin: {request_origin}')
+            raise HTTPResponseException('Unknown origin.', statusCode=403)
+
+        kwargs['request_origin'] = request_origin
+
+    def after(event, context, kwargs, response):
+        if not isinstance(response, dict):
+            raise Exception(
+                f'Unsupported response type {type(response)}; response must be dict for *_response decorators.')
+
+        # add origin to response headers
+        current_headers = response.get('headers', {})
+        cors_headers = {'Access-Control-Allow-Origin': kwargs['request_origin'],
+                        'Access-Control-Allow-Credentials': 'true'}
+        response['headers'] = {**current_headers, **cors_headers}
+        return response
+
+    return Step(before, after)
+
+
 def allow_origin_response(*origins):
     """ Decorator that will check that the event.headers.origin is in origins; if the origin
     is valid, this decorator will add it to the response headers.
@@ -81,36 +175,41 @@ def allow_origin_response(*origins):
     Returns:
         handler (func): a lambda handler function that is authorized
     """
+    step = _allow_origin_step(*origins)
+
     def allow_origin_handler(handler):
         def handler_wrapper(event, context, **kwargs):
-            logger.debug(f'Checking origin for event: {event}')
-
-            # Check Origin
-            request_origin = utils.deep_get(event, 'headers', 'origin', ignore_case=True)
-            if not any(re.match(o, str(request_origin)) for o in origins):
-                logger.warning(f'Invalid request origin: {request_origin}')
-                raise HTTPResponseException('Unknown origin.', statusCode=403)
-
-            # call handler
-            kwargs['request_origin'] = request_origin
+            step.before(event, context, kwargs)
             response = handler(event, context, **kwargs)
-
-            if not isinstance(response, dict):
-                raise Exception(
-                    f'Unsupported response type {type(response)}; response must be dict for *_response decorators.')
-
-            # add origin to response headers
-            current_headers = response.get('headers', {})
-            cors_headers = {'Access-Control-Allow-Origin': request_origin,
-                            'Access-Control-Allow-Credentials': 'true'}
-            response['headers'] = {**current_headers, **cors_headers}
-            return response
+            return step.after(event, context, kwargs, response)
 
         return handler_wrapper
 
     return allow_origin_handler
 
 
+def _parameters_step(required_querystring=None, optional_querystring=None, path=None, error=None):
+    def before(event, context, kwargs):
+        for param in required_querystring if required_querystring else {}:
+            value = utils.deep_get(event, 'queryStringParameters', param)
+            if not value:
+                logger.error(f'queryStringParameter [{param}] missing from event [{event}].')
+                raise HTTPResponseException(error or f'Invalid {param}.', statusCode=400)
+            kwargs[param] = value
+        for param in optional_querystring if optional_querystring else {}:
+            value = utils.deep_get(event, 'queryStringParameters', param)
+            if value:
+                kwargs[param] = value
+        for param in path if path else {}:
+            value = utils.deep_get(event, 'pathParameters', param)
+            if not value:
+                logger.error(f'pathParameter [{param}] missing from event [{event}].')
+                raise HTTPResponseException(error or f'Invalid {param}.', statusCode=400)
+            kwargs[param] = value
+
+    return Step(before)
+
+
 def parameters(required_querystring=None, optional_querystring=None, path=None, error=None):
     """ Decorator that will check and add queryStringParameters
         and pathParameters to the event kwargs.
@@ -123,24 +222,11 @@ def parameters(required_querystring=None, optional_querystring=None, path=None,
     Returns:
         handler (func): a lambda handler function that is namespace aware
     """
+    step = _parameters_step(required_querystring, optional_querystring, path, error)
+
     def parameters_handler(handler):
         def handler_wrapper(event, context, **kwargs):
-            for param in required_querystring if required_querystring else {}:
-                value = utils.deep_get(event, 'queryStringParameters', param)
-                if not value:
-                    logger.error(f'queryStringParameter [{param}] missing from event [{event}].')
-                    raise HTTPResponseException(error or f'Invalid {param}.', statusCode=400)
-                kwargs[param] = value
-            for param in optional_querystring if optional_querystring else {}:
-                value = utils.deep_get(event, 'queryStringParameters', param)
-                if value:
-                    kwargs[param] = value
-            for param in path if path else {}:
-                value = utils.deep_get(event, 'pathParameters', param)
-                if not value:
-                    logger.error(f'pathParameter [{param}] missing from event [{event}].')
-                    raise HTTPResponseException(error or f'Invalid {param}.', statusCode=400)
-                kwargs[param] = value
+            step.before(event, context, kwargs)
             return handler(event, context, **kwargs)
 
         return handler_wrapper
@@ -148,40 +234,72 @@ def parameters(required_querystring=None, optional_querystring=None, path=None,
     return parameters_handler
 
 
-def body(required=None, optional=None, error=None):
+def _body_step(required=None, optional=None, error=None, json_backend=None):
+    def before(event, context, kwargs):
+        try:
+            event_body = request_context.body(event, backend=json_backend)
+        except json.JSONDecodeError:
+            raise HTTPResponseException(error or 'Invalid event.body: cannot decode json.', statusCode=400)
+
+        body_required = {k: event_body.get(k) for k in (required if required else {})}
+        if not all((v is not None for v in body_required.values())):
+            logger.error(f'There is a required key in [{required}] missing from event.body [{event_body}].')
+            raise HTTPResponseException(error or 'Invalid event.body: missing required key.', statusCode=400)
+
+        body_optional = {k: event_body.get(k) for k in (optional if optional else {})}
+
+        handler_body = {}
+        handler_body.update(**body_required, **body_optional)
+        kwargs['body'] = handler_body
+
+    return Step(before)
+
+
+def body(required=None, optional=None, error=None, json_backend=None):
     """ Decorator that will check that event.get('body') has keys, then add a map of selected keys
     to kwargs.
 
+    The body is parsed once per event and shared; handlers that need all of it should call
+    request_context.body(event) rather than parsing event['body'] again.
+
     Args:
         required (iterable): Required body keys
         optional (iterable): Optional body keys
+        json_backend (str): 'simplejson', 'orjson' or 'auto', see serialization.loads
 
     Returns:
         handler (func): a lambda handler function that is namespace aware
     """
+    step = _body_step(required, optional, error, json_backend)
+
     def body_handler(handler):
         def handler_wrapper(event, context, **kwargs):
-            try:
-                event_body = json.loads(event.get('body'))
-            except json.JSONDecodeError:
-                raise HTTPResponseException(error or 'Invalid event.body: cannot decode json.', statusCode=400)
+            step.before(event, context, kwargs)
+            return handler(event, context, **kwargs)
 
-            body_required = {k: event_body.get(k) for k in (required if required else {})}
-            if not all((v is not None for v in body_required.values())):
-                logger.error(f'There is a required key in [{required}] missing from event.body [{event_body}].')
-                raise HTTPResponseException(error or 'Invalid event.body: missing required key.', statusCode=400)
+        return handler_wrapper
 
-            body_optional = {k: event_body.get(k) for k in (optional if optional else {})}
+    return body_handler
 
-            handler_body = {}
-            handler_body.update(**body_required, **body_optional)
-            kwargs['body'] = handler_body
 
-            return handler(event, context, **kwargs)
+def _scopes_step(*scope_list):
+    try:
+        string_scope_list = [str(s) for s in scope_list]
+    except Exception as err:
+        logger.exception(err)
+        raise TypeError('All scopes must be castable to string.')
 
-        return handler_wrapper
+    def before(event, context, kwargs):
+        token_scopes = utils.deep_get(event, 'requestContext', 'authorizer', 'scopes')
 
-    return body_handler
+        if not token_scopes:
+            raise HTTPResponseException('Invalid token scopes: missing!')
+
+        if not all((s in token_scopes for s in string_scope_list)):
+            logger.warning(f'There is a required scope [{scope_list}] missing from token scopes [{token_scopes}].')
+            raise HTTPResponseException('access_token has insufficient access.', statusCode=403)
+
+    return Step(before)
 
 
 def scopes(*scope_list):
@@ -196,23 +314,11 @@ def scopes(*scope_list):
     Returns:
         handler (func): a lambda handler function that is namespace aware
     """
-    try:
-        string_scope_list = [str(s) for s in scope_list]
-    except Exception as err:
-        logger.exception(err)
-        raise TypeError('All scopes must be castable to string.')
+    step = _scopes_step(*scope_list)
 
     def scopes_handler(handler):
         def handler_wrapper(event, context, **kwargs):
-            token_scopes = utils.deep_get(event, 'requestContext', 'authorizer', 'scopes')
-
-            if not token_scopes:
-                raise HTTPResponseException('Invalid token scopes: missing!')
-
-            if not all((s in token_scopes for s in string_scope_list)):
-                logger.warning(f'There is a required scope [{scope_list}] missing from token scopes [{token_scopes}].')
-                raise HTTPResponseException('access_token has insufficient access.', statusCode=403)
-
+            step.before(event, context, kwargs)
             return handler(event, context, **kwargs)
 
         return handler_wrapper
@@ -220,6 +326,15 @@ def scopes(*scope_list):
     return scopes_handler
 
 
+def _sub_aware_before(event, context, kwargs):
+    sub = utils.deep_get(event, 'requestContext', 'authorizer', 'sub')
+    if not sub:
+        logger.error('Sub requestContext variable missing.')
+        raise HTTPResponseException('Invalid sub.')
+
+    kwargs['sub'] = sub
+
+
 def sub_aware(handler):
     """ Decorator that will check and add event.requestContext.authorizer.sub to the event kwargs.
 
@@ -230,68 +345,166 @@ def sub_aware(handler):
         handler (func): a lambda handler function that is sub aware
     """
     def handler_wrapper(event, context, **kwargs):
-        sub = utils.deep_get(event, 'requestContext', 'authorizer', 'sub')
-        if not sub:
-            logger.error('Sub requestContext variable missing.')
-            raise HTTPResponseException('Invalid sub.')
-
-        kwargs['sub'] = sub
+        _sub_aware_before(event, context, kwargs)
         return handler(event, context, **kwargs)
 
     return handler_wrapper
 
 
-def http_response(default_error_message=None):
+def _compress_response(event, response, threshold, metrics_hook):
+    body = response['body']
+    if body is None or any(h.lower() == 'content-encoding' for h in response['headers']):
+        return response
+    data = body.encode('utf-8')
+    if len(data) < threshold:
+        return response
+    encoding = compression.negotiate(request_context.headers(event).get('accept-encoding'))
+    if not encoding:
+        return response
+
+    start = time.perf_counter()
+    compressed = compression.compress(data, encoding)
+    metrics = {
+        'encoding': encoding,
+        'original_bytes': len(data),
+        'compressed_bytes': len(compressed),
+        'ratio': len(compressed) / len(data),
+        'seconds': time.perf_counter() - start,
+    }
+    logger.debug(f'Compressed response: {metrics}')
+    if metrics_hook:
+        metrics_hook(metrics)
+    if len(compressed) >= len(data):
+        return response
+
+    response['headers'] = {**response['headers'], 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    if 'ETag' in response['headers'] and not response['headers']['ETag'].startswith('W/'):
+        # the compressed bytes differ from those the (strong) ETag was computed on
+        response['headers']['ETag'] = f"W/{response['headers']['ETag']}"
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def _quote_etag(value):
+    value = str(value)
+    return value if value.startswith(('"', 'W/"')) else f'"{value}"'
+
+
+def _etag_matches(event, etag):
+    if_none_match = request_context.headers(event).get('if-none-match')
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, i.e. ignores W/ prefixes
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    return False
+
+
+def _http_response_step(default_error_message=None, json_backend=None, compress_threshold=None, metrics_hook=None,
+                        etag=False):
+    def after(event, context, kwargs, res):
+        if not isinstance(res, dict):
+            raise Exception(f'Unsupported return type {type(res)}; response must be dict.')
+        headers = res.get('headers', {})
+        status_code = res.get('statusCode', 200)
+        conditional = etag and status_code == 200
+
+        tag = None
+        if conditional and res.get('etag', res.get('version')) is not None:
+            tag = _quote_etag(res.get('etag', res.get('version')))
+            if _etag_matches(event, tag):
+                return {'headers': {**headers, 'ETag': tag}, 'statusCode': 304, 'body': None}
+
+        response = {
+            'headers': headers,
+            'statusCode': status_code,
+            'body': serialization.dumps(res['body'], backend=json_backend) if 'body' in res else None,
+        }
+        if conditional and tag is None and response['body'] is not None:
+            tag = f'"{hashlib.blake2b(response["body"].encode("utf-8"), digest_size=16).hexdigest()}"'
+            if _etag_matches(event, tag):
+                return {'headers': {**headers, 'ETag': tag}, 'statusCode': 304, 'body': None}
+        if tag is not None:
+            response['headers'] = {**headers, 'ETag': tag}
+
+        if compress_threshold is not None:
+            response = _compress_response(event, response, compress_threshold, metrics_hook)
+        return response
+
+    def error(event, context, err):
+        logger.exception(err)
+        # Handle HTTPResponseException and HTTPResponseException like objects
+        if isinstance(err, HTTPResponseException) or (hasattr(err, 'statusCode') and hasattr(err, 'body')):
+            return {
+                'statusCode': err.statusCode,
+                'body': serialization.dumps(err.body, backend=json_backend),
+            }
+        else:
+            lambda_function_name = context.function_name.split('.')[-1].replace('_', ' ')
+            return {
+                'statusCode': 500,
+                'body': default_error_message or f'Failed to {lambda_function_name}.',
+            }
+
+    return Step(after=after, error=error)
+
+
+def http_response(default_error_message=None, json_backend=None, compress_threshold=None, metrics_hook=None,
+                  etag=False):
     """ Decorator that will wrap handler response in an API Gateway compatible dict with
     statusCode and json serialized body. If handler result has a 'body', this decorator
     will serialize it into the API Gateway body; if the handler result does _not_ have a
     body, this decorator will return statusCode 200 and serialize the entire result.
 
+    With compress_threshold set, serialized bodies of at least that many bytes are compressed
+    (brotli or gzip, see compression.negotiate) when the request's Accept-Encoding allows it,
+    and returned base64 encoded with isBase64Encoded and Content-Encoding set. API Gateway must
+    be configured to pass binary responses through. Bodies that would not shrink are left as is.
+
+    With etag=True, 200 responses get an ETag header, a hash of the serialized body, and requests
+    whose If-None-Match matches it get an empty 304 Not Modified instead. A handler can return
+    an 'etag' (or 'version') next to its 'body' to use instead of the hash; the body is then not
+    even serialized for a 304.
+
     Args:
         default_error_message (string): Default message to send if none was provided
+        json_backend (str): 'simplejson', 'orjson' or 'auto', see serialization.dumps
+        compress_threshold (int): minimum body size, in bytes, to compress; None to never compress
+        metrics_hook (func): called with a dict of encoding, original_bytes, compressed_bytes,
+            ratio and seconds for every compressed body (also logged at debug level)
+        etag (bool): add ETags to, and answer If-None-Match for, 200 responses
 
     Returns:
         handler (func): a lambda handler function that whose result is HTTPGateway compatible.
     """
+    step = _http_response_step(default_error_message, json_backend, compress_threshold, metrics_hook, etag)
+
     def http_response_handler(handler):
         def handler_wrapper(event, context, **kwargs):
             try:
-                res = handler(event, context, **kwargs)
-                if not isinstance(res, dict):
-                    raise Exception(f'Unsupported return type {type(res)}; response must be dict.')
-                return {
-                    'headers': res.get('headers', {}),
-                    'statusCode': res.get('statusCode', 200),
-                    'body': json.dumps(res['body'], iterable_as_array=True) if 'body' in res else None,
-                }
-            except HTTPResponseException as err:
-                logger.exception(err)
-                return {
-                    'statusCode': err.statusCode,
-                    'body': json.dumps(err.body, iterable_as_array=True),
-                }
+                return step.after(event, context, kwargs, handler(event, context, **kwargs))
             except Exception as err:
-                logger.exception(err)
-                # Try and handle HTTPResponseException like objects
-                if hasattr(err, 'statusCode') and hasattr(err, 'body'):
-                    return {
-                        'statusCode': err.statusCode,
-                        'body': json.dumps(err.body, iterable_as_array=True),
-                    }
-                else:
-                    lambda_function_name = context.function_name.split('.')[-1].replace('_', ' ')
-                    return {
-                        'statusCode': 500,
-                        'body': default_error_message or f'Failed to {lambda_function_name}.',
-                    }
+                return step.error(event, context, err)
 
         return handler_wrapper
     return http_response_handler
 
 
+def _pausable_before(event, context, kwargs):
+    kwargs['PAUSE'] = os.environ.get('PAUSE')
+    if kwargs['PAUSE']:
+        logger.warning('Function paused')
+        raise HTTPResponseException('info: paused', statusCode=503)
+
+
 def pausable(handler):
     """ Decorator that will "pause', i.e. short circuit and return immediately before calling
     the decorated handler, if the PAUSE environment variable is set.
+    PAUSE is always read live, even when other variables are snapshot (see environ_aware).
 
     Args:
         handler (func): a handler function with the signature (event, context) -> result
@@ -299,15 +512,18 @@ def pausable(handler):
     Returns:
         handler (func): a pausable lambda handler
     """
-    @environ_aware([], ['PAUSE'])
     def handler_wrapper(event, context, **kwargs):
-        if kwargs.get('PAUSE'):
-            logger.warning('Function paused')
-            raise HTTPResponseException('info: paused', statusCode=503)
+        _pausable_before(event, context, kwargs)
         return handler(event, context, **kwargs)
     return handler_wrapper
 
 
+def _pingable_before(event, context, kwargs):
+    if event.get('detail-type') == 'Scheduled Event' and event.get('source') == 'aws.events':
+        logger.debug('Ping received, keeping function alive')
+        return 'info: ping'
+
+
 def pingable(handler):
     """ Decorator that will short circuit and return immediately before calling
     the decorated handler if the event is a "ping" event.
@@ -319,15 +535,295 @@ def pingable(handler):
         handler (func): a pingable lambda handler
     """
     def handler_wrapper(event, context, **kwargs):
-        if event.get('detail-type') == 'Scheduled Event' and event.get('source') == 'aws.events':
-            logger.debug('Ping received, keeping function alive')
-            return 'info: ping'
-        return handler(event, context, **kwargs)
+        return _pingable_before(event, context, kwargs) or handler(event, context, **kwargs)
 
     return handler_wrapper
 
 
-def publisher(handler):
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _cached_response_step(cache, lock, stats, path=None, querystring=None, key_kwargs=('sub', 'domain')):
+    def selected(parameters, names):
+        parameters = parameters or {}
+        if names is None:
+            return tuple(sorted(parameters.items()))
+        return tuple((name, parameters.get(name)) for name in names)
+
+    def key(event, kwargs):
+        return hashkey(selected(event.get('pathParameters'), path),
+                       selected(event.get('queryStringParameters'), querystring),
+                       tuple((name, _hashable(kwargs.get(name))) for name in key_kwargs))
+
+    def before(event, context, kwargs):
+        with lock:
+            response = cache.get(key(event, kwargs))
+        if response is None:
+            stats['misses'] += 1
+            return None
+        stats['hits'] += 1
+        return dict(response)
+
+    def after(event, context, kwargs, response):
+        if isinstance(response, dict) and response.get('statusCode', 200) == 200:
+            with lock:
+                cache[key(event, kwargs)] = dict(response)
+        return response
+
+    return Step(before, after), key
+
+
+def cached_response(ttl=60, maxsize=128, path=None, querystring=None, key_kwargs=('sub', 'domain')):
+    """ Decorator that memoizes a read-only handler's (successful, i.e. 200) response dicts for
+    ttl seconds, keyed on path and query string parameters and on some of the kwargs injected by
+    outer decorators (by default the caller's sub and domain, see sub_aware and domain_aware). At
+    most maxsize responses are kept, least recently used first out.
+
+    Place it inside http_response (and any decorator that injects a key kwarg). Cached responses
+    are shallow copies, so decorators may replace their keys, but bodies are shared between
+    invocations and must not be mutated.
+
+    The decorated handler has cache_stats (a Counter of hits and misses), cache_clear() and
+    cache_invalidate(event, **kwargs), which drops the response cached for that request.
+
+    Args:
+        ttl (float): seconds to keep a response
+        maxsize (int): maximum number of responses kept
+        path (iterable): pathParameters to key on; None for all of them
+        querystring (iterable): queryStringParameters to key on; None for all of them
+        key_kwargs (iterable): handler kwargs to key on
+
+    Returns:
+        handler (func): a lambda handler function that returns cached responses when it can
+    """
+    cache = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+    lock = threading.Lock()
+    stats = collections.Counter(hits=0, misses=0)
+    step, key = _cached_response_step(cache, lock, stats, path, querystring, key_kwargs)
+
+    def cached_response_handler(handler):
+        def handler_wrapper(event, context, **kwargs):
+            response = step.before(event, context, kwargs)
+            if response is not None:
+                return response
+            return step.after(event, context, kwargs, handler(event, context, **kwargs))
+
+        def cache_invalidate(event, **kwargs):
+            with lock:
+                cache.pop(key(event, kwargs), None)
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        handler_wrapper.cache_stats = stats
+        handler_wrapper.cache_invalidate = cache_invalidate
+        handler_wrapper.cache_clear = cache_clear
+        return handler_wrapper
+
+    return cached_response_handler
+
+
+def _message_id(event):
+    record = (event.get('Records') or [{}])[0]
+    return utils.deep_get(record, 'Sns', 'MessageId') or record.get('messageId') or event.get('id')
+
+
+def _body_hash(event):
+    record = (event.get('Records') or [{}])[0]
+    body = event.get('body') or utils.deep_get(record, 'Sns', 'Message') or record.get('body')
+    if body is None:
+        return None
+    return hashlib.blake2b(body.encode('utf-8') if isinstance(body, str) else body, digest_size=16).hexdigest()
+
+
+def _idempotency_key_fn(key):
+    if callable(key):
+        return key
+    if key == 'message_id':
+        return _message_id
+    if key == 'body':
+        return _body_hash
+    if isinstance(key, str) and key.startswith('header:'):
+        header = key[len('header:'):]
+        return lambda event: request_context.headers(event).get(header)
+    raise ValueError(f'Unsupported idempotency key {key}.')
+
+
+def idempotent(table_name, key='message_id', ttl=idempotency.DEFAULT_TTL,
+               in_progress_ttl=idempotency.DEFAULT_IN_PROGRESS_TTL,
+               local_cache_size=idempotency.DEFAULT_LOCAL_CACHE_SIZE, client=None):
+    """ Decorator that handles each request only once: the response of the first invocation for
+    a key is stored in DynamoDB (see idempotency), and repeats (e.g. retried SNS/SQS deliveries or
+    client retries) get that response back without calling the handler. Repeats that arrive
+    while the first is still running raise idempotency.IdempotencyInProgressException (a 409 for
+    http_response). If the handler raises, nothing is stored and the request can be retried.
+
+    Put it outside publisher/event_publisher, so repeats don't publish again, and inside
+    http_response, so the stored response is the handler's. Responses are stored as JSON (see
+    serialization.dumps), so e.g. sets come back as lists.
+
+    Args:
+        table_name (str): DynamoDB table with a string hash key named `id`
+        key (str|func): what identifies a request: 'message_id' (SNS/SQS message id or
+            EventBridge event id), 'body' (hash of the body/message), 'header:<name>' (e.g.
+            'header:Idempotency-Key') or a function of the event. Requests without a key are
+            handled normally.
+        ttl (int): seconds to remember responses for
+        in_progress_ttl (int): seconds after which an unfinished invocation no longer blocks repeats
+        local_cache_size (int): number of responses to also keep in memory, sparing DynamoDB reads
+            for hot duplicates
+        client: DynamoDB client; defaults to the shared one, see clients.client
+
+    Returns:
+        handler (func): a lambda handler function that is idempotent
+    """
+    key_fn = _idempotency_key_fn(key)
+    store = idempotency.conn(table_name, client=client, local_cache_size=local_cache_size)
+
+    def idempotent_handler(handler):
+        def handler_wrapper(event, context, **kwargs):
+            raw_key = key_fn(event)
+            if raw_key is None:
+                logger.warning(f'No idempotency key for {handler.__name__}; handling the request anyway.')
+                return handler(event, context, **kwargs)
+
+            request_key = f'{handler.__module__}.{handler.__name__}#{raw_key}'
+            claimed, response = idempotency.begin(store, request_key, in_progress_ttl)
+            if not claimed:
+                logger.info(f'Request {request_key} already handled; returning the stored response.')
+                return response
+
+            try:
+                response = handler(event, context, **kwargs)
+            except Exception:
+                idempotency.release(store, request_key)
+                raise
+            try:
+                idempotency.complete(store, request_key, response, ttl)
+            except Exception as err:
+                # the request succeeded; its claim expires after in_progress_ttl
+                logger.exception(f'Could not store the response of {request_key}: {err}')
+            return response
+
+        return handler_wrapper
+
+    return idempotent_handler
+
+
+def deadline_aware(reserve_ms=deadline.DEFAULT_RESERVE_MS, interrupt=False):
+    """ Decorator that makes the lambda deadline (context.get_remaining_time_in_millis) the current
+    one (see deadline) and passes it to the handler as the `deadline` kwarg (None outside lambda).
+
+    AWS clients obtained from clients.client while the handler runs (as configuration, publish,
+    lambda_helpers and idempotency do) get timeouts that fit in the remaining time less the
+    reserve. When the budget is used up, e.g. a call timed out, the handler's error becomes a
+    deadline.DeadlineExceededException, i.e. a 503 for http_response, so the function returns
+    instead of being killed. With interrupt=True, a handler still running when the budget runs
+    out is interrupted (SIGALRM, so only in the main thread, which is where lambda runs it).
+
+    Put it inside http_response and outside the decorators whose AWS calls it should cover
+    (e.g. configuration_aware, publisher).
+
+    Args:
+        reserve_ms (int): milliseconds to keep for returning a response
+        interrupt (bool): interrupt the handler when the budget runs out
+
+    Returns:
+        handler (func): a lambda handler function that is deadline aware
+    """
+    def deadline_handler(handler):
+        def handler_wrapper(event, context, **kwargs):
+            current = deadline.from_context(context, reserve_ms)
+            kwargs['deadline'] = current
+            if current is None:
+                return handler(event, context, **kwargs)
+
+            current.check()
+            with deadline.scope(current):
+                try:
+                    if interrupt:
+                        with deadline.alarm(current):
+                            return handler(event, context, **kwargs)
+                    return handler(event, context, **kwargs)
+                except deadline.DeadlineExceededException:
+                    logger.error(f'{handler.__name__} ran out of time.')
+                    raise
+                except Exception as err:
+                    if not current.expired():
+                        raise
+                    logger.error(f'{handler.__name__} ran out of time: {err}')
+                    raise deadline.DeadlineExceededException() from err
+
+        return handler_wrapper
+
+    return deadline_handler
+
+
+def _publish(deferred, publish_fn, conn, targets, **kwargs):
+    pending = _deferred_publishes.get()
+    if not deferred or not targets:
+        publish_fn(conn, targets, **kwargs)
+    elif pending is None:
+        logger.warning('Deferred publish outside of flush_publishes; publishing synchronously.')
+        publish_fn(conn, targets, **kwargs)
+    else:
+        pending.append((list(targets), publish.defer(publish_fn, conn, targets, **kwargs)))
+
+
+def flush_publishes(reserve_ms=DEFERRED_PUBLISH_RESERVE_MS, on_report=None):
+    """ Decorator that joins the publishes started by publisher(deferred=True) and
+    event_publisher(deferred=True) before the invocation ends. Apply it outermost, so everything
+    it wraps (e.g. http_response) runs while the messages are being published. The join is bounded
+    by context.get_remaining_time_in_millis() less reserve_ms; publishes that fail or do not finish
+    in time are logged (and passed to on_report).
+
+    For example:
+
+    @flush_publishes()
+    @http_response()
+    @publisher(deferred=True)
+    def handler(event, context, **kwargs):
+        return {'body': ..., 'messages': ...}
+
+    Args:
+        reserve_ms (int): milliseconds of the invocation to keep back when waiting for publishes
+        on_report (func): optional callable receiving the report of publish.join
+
+    Returns:
+        handler (func): a lambda handler that finishes its deferred publishes
+    """
+    def flush_publishes_handler(handler):
+        def handler_wrapper(event, context, **kwargs):
+            pending = []
+            token = _deferred_publishes.set(pending)
+            try:
+                return handler(event, context, **kwargs)
+            finally:
+                _deferred_publishes.reset(token)
+                if pending:
+                    remaining_ms = context.get_remaining_time_in_millis() if hasattr(
+                        context, 'get_remaining_time_in_millis') else None
+                    timeout = None if remaining_ms is None else max(remaining_ms - reserve_ms, 0) / 1000
+                    report = publish.join(pending, timeout)
+                    for targets, err in report['failed']:
+                        logger.error(f'Deferred publish to {targets} failed: {err}')
+                    if report['dropped']:
+                        logger.error(f'Deferred publishes to {report["dropped"]} did not finish in time.')
+                    if on_report:
+                        on_report(report)
+
+        return handler_wrapper
+
+    return flush_publishes_handler
+
+
+def publisher(handler=None, max_concurrency=None, claim_check=None, deferred=False):
     """ Decorator that will publish messages to SNS Topics. This decorator looks for a 'messages'
     key in the result of the wrapper decorator. It expects result['messages'] to be a dict where
     key is Topic Name or ARN and value is the message to be sent. It will publish each message to
@@ -340,26 +836,35 @@ def publisher(handler):
         'topic-2': {'dictionary': 'message'},
     }
 
+    The decorator can be used bare (@publisher) or with options (@publisher(max_concurrency=4)).
+
     Args:
         handler (func): lambda handler whose result will be checked for messages to publish
+        max_concurrency (int): optionally publish to up to this many topics in parallel
+        claim_check (dict): optionally offload oversized messages to S3, see publish.claim_check
+        deferred (Bool): optionally publish on a background thread once the handler returns, so the
+                         response is built while publishing; see flush_publishes
 
     Returns:
         handler (func): a publishing lambda handler
     """
+    if handler is None:
+        return functools.partial(publisher, max_concurrency=max_concurrency, claim_check=claim_check,
+                                 deferred=deferred)
 
     @account_id_aware
     @namespace_aware
     @region_aware
     def handler_wrapper(event, context, **kwargs):
         result = handler(event, context, **kwargs)
-        conn = publish.conn(kwargs['region'], kwargs['account_id'], kwargs['NAMESPACE'])
-        publish.publish(conn, result.get('messages', {}))
+        conn = publish.conn(kwargs['region'], kwargs['account_id'], kwargs['NAMESPACE'], claim_check=claim_check)
+        _publish(deferred, publish.publish, conn, result.get('messages', {}), max_concurrency=max_concurrency)
         return result
 
     return handler_wrapper
 
 
-def event_publisher(handler):
+def event_publisher(handler=None, max_concurrency=None, claim_check=None, deferred=False):
     """ Decorator that will publish events to SNS Topics (and eventually EventBridge).
     This decorator looks for a 'events' key in the result of the wrapper decorator.
     It expects result['events'] to be a dict where key is target (i.e. Topic Name or EventBus)
@@ -396,12 +901,21 @@ def event_publisher(handler):
         ]
     }
 
+    The decorator can be used bare (@event_publisher) or with options (@event_publisher(max_concurrency=4)).
+
     Args:
         handler (func): lambda handler whose result will be checked for messages to publish
+        max_concurrency (int): optionally publish to up to this many targets in parallel
+        claim_check (dict): optionally offload oversized messages to S3, see publish.claim_check
+        deferred (Bool): optionally publish on a background thread once the handler returns, so the
+                         response is built while publishing; see flush_publishes
 
     Returns:
         handler (func): a publishing lambda handler
     """
+    if handler is None:
+        return functools.partial(event_publisher, max_concurrency=max_concurrency, claim_check=claim_check,
+                                 deferred=deferred)
 
     @account_id_aware
     @namespace_aware
@@ -409,37 +923,51 @@ def event_publisher(handler):
     def handler_wrapper(event, context, **kwargs):
         result = handler(event, context, **kwargs)
         # TODO: Add code to check configuration and send via SNS or EventBridge accordingly
-        conn = publish.conn(kwargs['region'], kwargs['account_id'], kwargs['NAMESPACE'])
-        publish.publish_events(conn, result.get('events', {}))
+        conn = publish.conn(kwargs['region'], kwargs['account_id'], kwargs['NAMESPACE'], claim_check=claim_check)
+        _publish(deferred, publish.publish_events, conn, result.get('events', {}), max_concurrency=max_concurrency)
         return result
 
     return handler_wrapper
 
 
-def subscriber(required_topics=None):
-    """ Decorator that will grab messages from sns location in event body.
+def _subscriber_step(required_topics=None, json_backend=None):
+    def before(event, context, kwargs):
+        try:
+            sns = event['Records'][0]['Sns']
+        except Exception:
+            raise Exception('Unsupported event format.')
+        if required_topics and not any((topic_name in sns['TopicArn'] for topic_name in required_topics)):
+            raise Exception('Message received not from expected topic.')
+        try:
+            message_body = serialization.loads(sns.get('Message'), backend=json_backend)
+        except Exception as err:
+            raise Exception(f'Could not decode message. ({err})')
+        try:
+            message_body = publish.resolve_claim_check(message_body)
+        except Exception as err:
+            raise Exception(f'Could not resolve claimed message. ({err})')
+
+        kwargs['message'] = message_body
+
+    return Step(before)
+
+
+def subscriber(required_topics=None, json_backend=None):
+    """ Decorator that will grab messages from sns location in event body. Messages offloaded to S3
+    by a claim check publisher (see publish.claim_check) are fetched transparently.
 
     Args:
         required_topics (iterable): Handler must be triggered by one of these Topics
+        json_backend (str): 'simplejson', 'orjson' or 'auto', see serialization.loads
 
     Returns:
         handler (func): a lambda handler function that is namespace aware
     """
+    step = _subscriber_step(required_topics, json_backend)
+
     def subscriber_handler(handler):
         def handler_wrapper(event, context, **kwargs):
-            try:
-                sns = event['Records'][0]['Sns']
-            except Exception:
-                raise Exception('Unsupported event format.')
-            if required_topics and not any((topic_name in sns['TopicArn'] for topic_name in required_topics)):
-                raise Exception('Message received not from expected topic.')
-            try:
-                message_body = json.loads(sns.get('Message'))
-            except Exception as err:
-                raise Exception(f'Could not decode message. ({err})')
-
-            kwargs['message'] = message_body
-
+            step.before(event, context, kwargs)
             return handler(event, context, **kwargs)
 
         return handler_wrapper
@@ -447,43 +975,76 @@ def subscriber(required_topics=None):
     return subscriber_handler
 
 
-def configuration_aware(config_file, create=False):
+def _configuration_step(config_file, create=False, cache_ttl=None, lazy=False):
+    def before(event, context, kwargs):
+        config_bucket = os.environ['CONFIG']
+        encrypt_key_arn = os.environ.get('ENCRYPT_KEY_ARN')
+        state = {}
+
+        def connection():
+            if 'conn' not in state:
+                state['conn'] = conf.conn(encrypt_key_arn)
+            return state['conn']
+
+        def load():
+            if 'settings' not in state:
+                try:
+                    if cache_ttl is not None:
+                        state['settings'] = conf.load_cached(connection(), config_bucket, config_file,
+                                                             ttl=cache_ttl, create=create)
+                    elif create:
+                        state['settings'] = conf.load_or_create(connection(), config_bucket, config_file)
+                    else:
+                        state['settings'] = conf.load(connection(), config_bucket, config_file)
+                except Exception as err:
+                    logger.exception(err)
+                    logger.error('Failed to load or create configuration.')
+                    raise HTTPResponseException('Failed to load configuration.', statusCode=503)
+            return state['settings'] or {}
+
+        def save(settings):
+            state['settings'] = conf.save(connection(), config_bucket, config_file, settings)
+            return state['settings']
+
+        if not lazy:
+            load()
+
+        configuration = {
+            'load': load,
+            'save': save,
+        }
+        kwargs['configuration'] = configuration
+
+    return Step(before)
+
+
+def configuration_aware(config_file, create=False, cache_ttl=None, lazy=False):
     """ Decorator that expects a configuration file in an S3 Bucket specified by the 'CONFIG'
     environment variable and S3 Bucket Key (path) specified by config_file. If create=True, this
     decorator will create an empty configuration file instead of erring.
 
-    NOTE: Decorating a lambda with this incurs a performance penalty - S3 is checked on every call.
-          This makes sense when writing a lambda function that updates config and is called infrequently,
-          but makes far less sense if all one needs to do is read config data.
-    TODO: We need a more clear, refined pattern for dealing with uncached writes and cached reads.
-          The way the current config features are written, it's not clear how best to use them.
+    NOTE: Without cache_ttl, S3 is checked on every call. This makes sense when writing a lambda
+          function that updates config and is called infrequently. Read heavy functions should set
+          cache_ttl: the configuration is then kept across invocations of a warm container and, once
+          older than cache_ttl seconds, revalidated with a conditional (ETag) GetObject. Writes through
+          configuration['save'] update the cached entry. Within one invocation the configuration is
+          loaded at most once; after configuration['save'], configuration['load'] returns the saved settings.
 
     Args:
         config_file (str): key in the 'CONFIG' S3 bucket of expected configuration file
         create (Bool): optionally create configuration file if absent
+        cache_ttl (int|float): optionally cache the configuration for this many seconds (see conf.load_cached)
+        lazy (Bool): optionally defer loading until the handler first calls configuration['load'];
+                     handlers that never read configuration then make no S3 calls at all
 
     Returns:
         handler (func): a configuration aware lambda handler
     """
+    step = _configuration_step(config_file, create, cache_ttl, lazy)
+
     def configuration_handler(handler):
         def handler_wrapper(*args, **kwargs):
-            config_bucket = os.environ['CONFIG']
-            encrypt_key_arn = os.environ.get('ENCRYPT_KEY_ARN')
-
-            conn = conf.conn(encrypt_key_arn)
-            try:
-                settings = conf.load_or_create(conn, config_bucket, config_file) if create else conf.load(
-                    conn, config_bucket, config_file)
-            except Exception as err:
-                logger.exception(err)
-                logger.error('Failed to load or create configuration.')
-                raise HTTPResponseException('Failed to load configuration.', statusCode=503)
-
-            configuration = {
-                'load': lambda: settings or {},
-                'save': functools.partial(conf.save, conn, config_bucket, config_file),
-            }
-            kwargs["configuration"] = configuration
+            step.before(None, None, kwargs)
             return handler(*args, **kwargs)
 
         return handler_wrapper
@@ -491,6 +1052,16 @@ def configuration_aware(config_file, create=False):
     return configuration_handler
 
 
+def _client_config_aware_step(handler):
+    def before(event, context, kwargs):
+        client_details = tools.get_client_details(event)
+        logger.info(f"{handler.__name__} | {client_details}")
+        logger.debug(f'aws_lambda_wrapper| {event}')
+        kwargs['client_details'] = client_details
+
+    return Step(before)
+
+
 def client_config_aware(handler):
     """ Decorator that will find the Source IP and Client in the event headers.
 
@@ -500,15 +1071,18 @@ def client_config_aware(handler):
     Returns:
         handler (func): a client config aware lambda handler
     """
+    step = _client_config_aware_step(handler)
+
     def handler_wrapper(event, context, **kwargs):
-        client_details = tools.get_client_details(event)
-        logger.info(f"{handler.__name__} | {client_details}")
-        logger.debug(f'aws_lambda_wrapper| {event}')
-        kwargs['client_details'] = client_details
+        step.before(event, context, kwargs)
         return handler(event, context, **kwargs)
     return handler_wrapper
 
 
+def _region_aware_before(event, context, kwargs):
+    kwargs['region'] = tools.get_region(context)
+
+
 def region_aware(handler):
     """ Decorator that will find the Account Region in the lambda context.
 
@@ -519,12 +1093,15 @@ def region_aware(handler):
         handler (func): a region aware lambda handler
     """
     def handler_wrapper(event, context, **kwargs):
-        region = tools.get_region(context)
-        kwargs['region'] = region
+        _region_aware_before(event, context, kwargs)
         return handler(event, context, **kwargs)
     return handler_wrapper
 
 
+def _account_id_aware_before(event, context, kwargs):
+    kwargs['account_id'] = tools.get_account_id(context)
+
+
 def account_id_aware(handler):
     """ Decorator that will find the Account ID in the lambda context.
 
@@ -535,8 +1112,7 @@ def account_id_aware(handler):
         handler (func): a context aware lambda handler
     """
     def handler_wrapper(event, context, **kwargs):
-        account_id = tools.get_account_id(context)
-        kwargs['account_id'] = account_id
+        _account_id_aware_before(event, context, kwargs)
         return handler(event, context, **kwargs)
     return handler_wrapper
 
@@ -560,11 +1136,110 @@ def catch_exceptions(handler):
     return handler_wrapper
 
 
-def default(default_error_message=None):
+_PIPELINE_STEPS = {
+    'account_id_aware': lambda handler: Step(_account_id_aware_before),
+    'allow_origin_response': lambda handler, *origins: _allow_origin_step(*origins),
+    'body': lambda handler, *args, **kwargs: _body_step(*args, **kwargs),
+    'client_config_aware': lambda handler: _client_config_aware_step(handler),
+    'configuration_aware': lambda handler, *args, **kwargs: _configuration_step(*args, **kwargs),
+    'domain_aware': lambda handler: Step(_domain_aware_before),
+    'environ_aware': lambda handler, *args, **kwargs: _environ_step(*args, **kwargs),
+    'http_response': lambda handler, *args, **kwargs: _http_response_step(*args, **kwargs),
+    'namespace_aware': lambda handler: _environ_step(['NAMESPACE'], []),
+    'parameters': lambda handler, *args, **kwargs: _parameters_step(*args, **kwargs),
+    'pausable': lambda handler: Step(_pausable_before),
+    'pingable': lambda handler: Step(_pingable_before),
+    'region_aware': lambda handler: Step(_region_aware_before),
+    'scopes': lambda handler, *scope_list: _scopes_step(*scope_list),
+    'sub_aware': lambda handler: Step(_sub_aware_before),
+    'subscriber': lambda handler, *args, **kwargs: _subscriber_step(*args, **kwargs),
+}
+
+
+def _pipeline_step(handler, step):
+    if isinstance(step, str):
+        step = (step,)
+    name, args, kwargs = step[0], step[1] if len(step) > 1 else (), step[2] if len(step) > 2 else {}
+    if name not in _PIPELINE_STEPS:
+        raise ValueError(f'Unsupported pipeline step {name}.')
+    return _PIPELINE_STEPS[name](handler, *args, **kwargs)
+
+
+def pipeline(*steps):
+    """ Decorator that compiles a declarative list of pyfaaster decorators into a single wrapper.
+    The result behaves like stacking the decorators in the given order (first = outermost): same
+    kwargs passed to the handler, same short circuits and same errors. But it costs one call frame
+    and one kwargs dict per invocation instead of one of each per decorator.
+
+    Each step is a decorator name, or a (name, args) or (name, args, kwargs) tuple for decorators
+    that take arguments. Supported: account_id_aware, allow_origin_response, body,
+    client_config_aware, configuration_aware, domain_aware, environ_aware, http_response,
+    namespace_aware, parameters, pausable, pingable, region_aware, scopes, sub_aware and subscriber.
+    http_response may only be the first step.
+
+    For example, this is equivalent to default():
+
+    @pipeline('http_response',
+              'account_id_aware',
+              'client_config_aware',
+              ('configuration_aware', ['configuration.json'], {'create': True}),
+              ('environ_aware', [['NAMESPACE', 'CONFIG'], ['ENCRYPT_KEY_ARN']]),
+              'pingable')
+    def handler(event, context, **kwargs):
+        ...
+
+    Args:
+        steps: decorator names or (name, args[, kwargs]) tuples, outermost first
+
+    Returns:
+        handler (func): a lambda handler wrapped by all the steps
+    """
+    def pipeline_handler(handler):
+        compiled = [_pipeline_step(handler, step) for step in steps]
+        if any(step.error for step in compiled[1:]):
+            raise ValueError('http_response must be the first pipeline step.')
+
+        on_error = compiled[0].error if compiled else None
+        befores = [(i, step.before) for i, step in enumerate(compiled) if step.before]
+        afters = [(i, step.after) for i, step in reversed(list(enumerate(compiled))) if step.after]
+        depth = len(compiled)
+
+        def handler_wrapper(event, context, **kwargs):
+            try:
+                # steps before the one that short circuits (if any) see the response on the way out
+                entered = depth
+                for i, before in befores:
+                    response = before(event, context, kwargs)
+                    if response is not None:
+                        entered = i
+                        break
+                else:
+                    response = handler(event, context, **kwargs)
+
+                for i, after in afters:
+                    if i < entered:
+                        response = after(event, context, kwargs, response)
+                return response
+            except Exception as err:
+                if on_error is None:
+                    raise
+                return on_error(event, context, err)
+
+        return handler_wrapper
+
+    return pipeline_handler
+
+
+def default(default_error_message=None, lazy_configuration=False, snapshot_environ=False):
     """
     AWS lambda handler handler. A wrapper with standard boilerplate implementing the
     best practices we've developed
 
+    Args:
+        default_error_message (string): Default message to send if none was provided
+        lazy_configuration (Bool): only load 'configuration.json' when the handler calls configuration['load']
+        snapshot_environ (Bool): read NAMESPACE, CONFIG and ENCRYPT_KEY_ARN once per container, see environ_aware
+
     Returns:
         The wrapped lambda function or JSON response function when an error occurs.  When called,
         this wrapped function will return the appropriate output
@@ -572,12 +1247,12 @@ def default(default_error_message=None):
 
     def default_handler(handler):
 
-        @http_response(default_error_message)
-        @account_id_aware
-        @client_config_aware
-        @configuration_aware('configuration.json', create=True)
-        @environ_aware(['NAMESPACE', 'CONFIG'], ['ENCRYPT_KEY_ARN'])
-        @pingable
+        @pipeline(('http_response', [default_error_message]),
+                  'account_id_aware',
+                  'client_config_aware',
+                  ('configuration_aware', ['configuration.json'], {'create': True, 'lazy': lazy_configuration}),
+                  ('environ_aware', [['NAMESPACE', 'CONFIG'], ['ENCRYPT_KEY_ARN']], {'snapshot': snapshot_environ}),
+                  'pingable')
         def handler_wrapper(event, context, **kwargs):
             try:
                 return handler(event, context, **kwargs)
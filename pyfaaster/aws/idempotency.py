@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Idempotency records in DynamoDB, with a per-container LRU cache of completed results in front.
+
+The table needs a string hash key named `id`; enable DynamoDB TTL on the `expiration` attribute to
+have stale records removed.
+"""
+
+import threading
+import time
+
+from botocore.exceptions import ClientError
+import cachetools
+
+import pyfaaster.aws.clients as clients
+import pyfaaster.aws.dynamodb as dyn
+from pyfaaster.aws.exceptions import HTTPResponseException
+import pyfaaster.aws.tools as tools
+import pyfaaster.common.serialization as serialization
+
+logger = tools.setup_logging('pyfaaster')
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+DEFAULT_TTL = 3600
+DEFAULT_IN_PROGRESS_TTL = 300
+DEFAULT_LOCAL_CACHE_SIZE = 256
+
+
+class IdempotencyInProgressException(HTTPResponseException):
+    """Raised when the same request is already being handled (by this or another container). It
+    is a 409 for http_response; for SNS/SQS it fails the delivery so that it is retried later."""
+
+    def __init__(self, key):
+        super().__init__(f'Request {key} is already in progress.', statusCode=409)
+        self.key = key
+
+
+def _client(conn):
+    return conn['client'] or clients.client('dynamodb')
+
+
+def _local_get(conn, key):
+    with conn['lock']:
+        entry = conn['local'].get(key)
+    if entry and entry[0] > time.time():
+        return entry[1]
+    return None
+
+
+def _local_put(conn, key, expiration, response):
+    with conn['lock']:
+        conn['local'][key] = (expiration, response)
+
+
+def _existing(conn, key, err):
+    item = err.response.get('Item')
+    if item is None:
+        item = _client(conn).get_item(TableName=conn['table'], Key=dyn.serialize_item({'id': key}),
+                                      ConsistentRead=True).get('Item')
+    return dyn.deserialize_item(item) if item else None
+
+
+def begin(conn, key, in_progress_ttl=DEFAULT_IN_PROGRESS_TTL):
+    """ Claim `key`, unless it has already been handled.
+
+    Args:
+        conn (dict): see conn
+        key (str): idempotency key
+        in_progress_ttl (int): seconds after which an unfinished claim (e.g. of a timed out
+            invocation) expires and the key can be claimed again
+
+    Returns:
+        (bool, any): (True, None) if the key was claimed and the request should be handled;
+            (False, response) with the stored response if it has already been handled
+
+    Raises:
+        IdempotencyInProgressException: if the key is claimed but not completed yet
+    """
+    cached = _local_get(conn, key)
+    if cached is not None:
+        return False, serialization.loads(cached)
+
+    now = int(time.time())
+    try:
+        _client(conn).put_item(
+            TableName=conn['table'],
+            Item=dyn.serialize_item({'id': key, 'status': IN_PROGRESS, 'expiration': now + in_progress_ttl}),
+            ConditionExpression='attribute_not_exists(id) OR expiration < :now',
+            ExpressionAttributeValues=dyn.serialize_item({':now': now}),
+            ReturnValuesOnConditionCheckFailure='ALL_OLD',
+        )
+        return True, None
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        item = _existing(conn, key, err)
+
+    if not item or item['status'] != COMPLETED:
+        raise IdempotencyInProgressException(key)
+    _local_put(conn, key, int(item['expiration']), item['response'])
+    return False, serialization.loads(item['response'])
+
+
+def complete(conn, key, response, ttl=DEFAULT_TTL):
+    """ Store the response of a claimed key, see begin.
+
+    Args:
+        conn (dict): see conn
+        key (str): idempotency key
+        response: JSON serializable handler response
+        ttl (int): seconds to remember the response for
+    """
+    expiration = int(time.time()) + ttl
+    serialized = serialization.dumps(response)
+    _client(conn).put_item(
+        TableName=conn['table'],
+        Item=dyn.serialize_item({'id': key, 'status': COMPLETED, 'expiration': expiration, 'response': serialized}),
+    )
+    _local_put(conn, key, expiration, serialized)
+
+
+def release(conn, key):
+    """ Drop the claim on `key` (e.g. because handling it failed), so that it can be retried. """
+    try:
+        _client(conn).delete_item(TableName=conn['table'], Key=dyn.serialize_item({'id': key}),
+                                  ConditionExpression='#status = :status',
+                                  ExpressionAttributeNames={'#status': 'status'},
+                                  ExpressionAttributeValues=dyn.serialize_item({':status': IN_PROGRESS}))
+    except ClientError as err:
+        logger.warning(f'Could not release idempotency key {key}: {err}')
+
+
+def conn(table_name, client=None, local_cache_size=DEFAULT_LOCAL_CACHE_SIZE):
+    """ Create an idempotency store connection.
+
+    Args:
+        table_name (str): DynamoDB table with a string hash key named `id`
+        client: DynamoDB client; defaults to the shared one, see clients.client
+        local_cache_size (int): number of completed responses to cache in memory
+
+    Returns:
+        dict: connection to pass to begin, complete and release
+    """
+    return {
+        'table': table_name,
+        'client': client,
+        'local': cachetools.LRUCache(maxsize=local_cache_size),
+        'lock': threading.Lock(),
+    }
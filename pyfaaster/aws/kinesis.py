@@ -3,15 +3,115 @@
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
 import base64
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import gzip
+import threading
 
+import pyfaaster.aws.tools as tools
 
-def decode_record(record, compressed=False, transform_fn=lambda x: x):
-    data = record['kinesis']['data']
+logger = tools.setup_logging('pyfaaster')
+
+# A decoded kinesis record; `data` is the result of transform_fn
+Record = collections.namedtuple('Record', ['sequence_number', 'partition_key', 'data'])
+
+DEFAULT_CHUNK_SIZE = 64
+
+# Pools are shared by (and survive) invocations, keyed by (kind, workers)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _identity(x):
+    return x
+
+
+def _decode(data, compressed, transform_fn):
     decoded = base64.b64decode(data)
     return transform_fn((decoded if not compressed else gzip.decompress(decoded)).decode('utf-8'))
 
 
-def decode_records(records, compressed=False, transform_fn=lambda x: x):
-    return [decode_record(r, compressed, transform_fn)
-            for r in records]
+def _decode_chunk(datas, compressed, transform_fn):
+    return [_decode(data, compressed, transform_fn) for data in datas]
+
+
+def decode_record(record, compressed=False, transform_fn=_identity):
+    return _decode(record['kinesis']['data'], compressed, transform_fn)
+
+
+def _pool(kind, workers):
+    key = (kind, workers)
+    if key not in _pools:
+        with _pools_lock:
+            if key not in _pools and kind == 'process':
+                try:
+                    _pools[key] = ProcessPoolExecutor(max_workers=workers)
+                except (OSError, NotImplementedError) as err:
+                    # e.g. lambda, which has no /dev/shm for multiprocessing's semaphores
+                    logger.warning(f'Process pool unavailable ({err}); decoding on threads.')
+                    _pools[key] = _pool('thread', workers)
+            elif key not in _pools:
+                _pools[key] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pyfaaster-kinesis')
+    return _pools[key]
+
+
+def decode_records(records, compressed=False, transform_fn=_identity, workers=None, pool='thread',
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Decode (and transform) kinesis event records.
+
+    With workers > 1 the records are decoded in chunks on a pool of that many threads or
+    processes, which is kept for later invocations, and returned in their original order. zlib
+    releases the GIL while decompressing, so threads help most with compressed records; CPU bound
+    transforms (e.g. json.loads) scale better on processes, but then transform_fn must be
+    picklable (a module level function, not a lambda), and each chunk is copied between
+    processes. Where processes are not available (e.g. in lambda, which lacks /dev/shm), threads
+    are used instead.
+
+    Args:
+        records (list): kinesis event records
+        compressed (bool): whether the data is gzipped
+        transform_fn (func): applied to each decoded string
+        workers (int): number of parallel workers; None or 1 to decode serially
+        pool (str): 'thread' or 'process'
+        chunk_size (int): records per task
+
+    Returns:
+        list: transformed records, in order
+    """
+    if not workers or workers < 2 or len(records) <= chunk_size:
+        return [decode_record(r, compressed, transform_fn)
+                for r in records]
+
+    if pool not in ('thread', 'process'):
+        raise ValueError(f'Unsupported pool {pool}.')
+    datas = [r['kinesis']['data'] for r in records]
+    chunks = [datas[i:i + chunk_size] for i in range(0, len(datas), chunk_size)]
+    executor = _pool(pool, workers)
+    return [decoded
+            for chunk in executor.map(_decode_chunk, chunks, [compressed] * len(chunks), [transform_fn] * len(chunks))
+            for decoded in chunk]
+
+
+def stream_records(records, compressed=False, transform_fn=_identity):
+    """
+    Decode (and transform) `records` one at a time, as they are consumed, so that only one decoded
+    record needs to be in memory at once (unlike decode_records, which decodes the whole batch).
+
+    E.g.,
+    >>> records = [{'kinesis': {'data': 'aGk=', 'sequenceNumber': '1', 'partitionKey': 'pk'}}]
+    >>> next(stream_records(records, transform_fn=str.upper))
+    Record(sequence_number='1', partition_key='pk', data='HI')
+
+    Args:
+        records (iterable): kinesis event records
+        compressed (bool): whether the data is gzipped
+        transform_fn (func): applied to each decoded string
+
+    Returns:
+        generator: of Records
+    """
+    for record in records:
+        yield Record(record['kinesis'].get('sequenceNumber'),
+                     record['kinesis'].get('partitionKey'),
+                     decode_record(record, compressed, transform_fn))
@@ -6,7 +6,7 @@
 Various constructs used to make it easier to use AWS Lambda functions.
 """
 
-import boto3
+import pyfaaster.aws.clients as clients
 import pyfaaster.aws.tools as tools
 
 logger = tools.setup_logging('pyfaaster')
@@ -22,7 +22,7 @@ class LambdaInvokeException(Exception):
         self.inner_error = boto_error
 
 
-def lambda_invoke(namespace, base_func_name, func_prefix='', payload=bytes(), run_async=False, lambda_client=boto3.client('lambda')):
+def lambda_invoke(namespace, base_func_name, func_prefix='', payload=bytes(), run_async=False, lambda_client=None):
     """
     Invoke a lambda function
 
@@ -33,14 +33,15 @@ def lambda_invoke(namespace, base_func_name, func_prefix='', payload=bytes(), ru
         payload: The payload to send to the lambda function.  Default is an empty set of bytes.
         run_async (bool): If true, invoke the lambda in a non-blocking fire-and-forget manner.  If false, the
                           caller will wait for a response before continuing.
-        lambda_client: User-provided client for invoking lambda functions in other accounts, defaults to client
-                       for current account.
+        lambda_client: User-provided client for invoking lambda functions in other accounts, defaults to the
+                       shared client (see pyfaaster.aws.clients) for current account.
 
     Returns:
         The response from the lambda.  When using async mode, a response will be available, but it will
         never contain any output - just success/failure of delivery.
     """
 
+    lambda_client = lambda_client or clients.client('lambda')
     template = '{pref}-{namespace}-{name}'
     full_name = template.format(pref=func_prefix, namespace=namespace, name=base_func_name)
 
@@ -1,30 +1,123 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
-import boto3
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import random
+import threading
+import time
+import uuid
+
 import simplejson as json
 import datetime as dt
 
+import pyfaaster.aws.clients as clients
 import pyfaaster.aws.tools as tools
+import pyfaaster.common.serialization as serialization
 from voluptuous import Schema, ALLOW_EXTRA, All
 
 logger = tools.setup_logging('pyfaaster')
 
 
-def _publish_sns_message(conn, topic, message, **kwargs):
-    logger.debug(f'Publishing {message}')
+BATCH_SIZE = 10
+BATCH_BYTES = 256 * 1024
+BATCH_RETRIES = 3
+BATCH_BACKOFF = 0.05
+
+# SNS rejects messages over 256KB; leave some room for subject and message attributes
+CLAIM_CHECK_THRESHOLD = 240 * 1024
+CLAIM_CHECK = 'pyfaaster_claim_check'
+
+DEFERRED_WORKERS = 4
+_deferred_executor = None
+_deferred_lock = threading.Lock()
+
+
+class PublishException(Exception):
+    def __init__(self, message, errors) -> None:
+        super().__init__(message, errors)
+        self.errors = errors
+
 
-    topic_arn = topic.format(
+class PublishBatchException(Exception):
+    def __init__(self, message, failed) -> None:
+        super().__init__(message, failed)
+        self.failed = failed
+
+
+def _topic_arn(conn, topic):
+    return topic.format(
         namespace=conn['namespace']) if 'arn:aws:sns' in topic else conn['topic_arn_prefix'] + topic.format(
         namespace=conn['namespace'])
 
+
+def _check_in(claim_check, prepared_message):
+    """ Store an oversized message in S3 and return the (json) pointer message to publish instead. """
+    body = prepared_message.encode('utf-8')
+    if len(body) <= claim_check['threshold']:
+        return prepared_message
+
+    key = f"{claim_check['prefix']}{uuid.uuid4()}"
+    logger.debug(f"Offloading {len(body)} byte message to {claim_check['bucket']}/{key}")
+    (claim_check['s3'] or clients.client('s3')).put_object(
+        Bucket=claim_check['bucket'],
+        Key=key,
+        Body=gzip.compress(body) if claim_check['compress'] else body,
+        ContentType='application/json',
+        ServerSideEncryption='AES256',
+    )
+    return json.dumps({CLAIM_CHECK: {
+        'bucket': claim_check['bucket'],
+        'key': key,
+        'compressed': claim_check['compress'],
+        'size': len(body),
+    }})
+
+
+def _prepare_message(conn, message):
     if getattr(message, 'get', None) and not message.get('timestamp'):
         message['timestamp'] = str(dt.datetime.now(tz=dt.timezone.utc))
 
     if isinstance(message, str):
         prepared_message = message
     else:
-        prepared_message = json.dumps(message, iterable_as_array=True)
+        prepared_message = serialization.dumps(message)
+
+    if conn.get('claim_check'):
+        return _check_in(conn['claim_check'], prepared_message)
+    return prepared_message
+
+
+def resolve_claim_check(message, client=None):
+    """ If `message` is a claim check pointer (see `claim_check`), fetch and decode the original
+    message from S3; otherwise return `message` unchanged. The S3 object is decompressed and
+    decoded as it streams in, rather than downloaded into memory first.
+
+    Args:
+        message: a decoded SNS message
+        client: optional S3 client
+
+    Returns:
+        the original message
+    """
+    pointer = message.get(CLAIM_CHECK) if isinstance(message, dict) and len(message) == 1 else None
+    if not pointer:
+        return message
+
+    logger.debug(f"Resolving claim check {pointer['bucket']}/{pointer['key']}")
+    body = (client or clients.client('s3')).get_object(Bucket=pointer['bucket'], Key=pointer['key'])['Body']
+    try:
+        return json.load(gzip.GzipFile(fileobj=body, mode='rb') if pointer.get('compressed') else body)
+    finally:
+        body.close()
+
+
+def _publish_sns_message(conn, topic, message, **kwargs):
+    logger.debug(f'Publishing {message}')
+
+    topic_arn = _topic_arn(conn, topic)
+    prepared_message = _prepare_message(conn, message)
 
     logger.debug(f'Publishing {message} to {topic_arn}')
 
@@ -37,6 +130,63 @@ def _publish_sns_message(conn, topic, message, **kwargs):
     return message
 
 
+def _entry_size(entry):
+    attributes = entry.get('MessageAttributes', {})
+    return (len(entry['Message'].encode('utf-8')) + len(entry.get('Subject', '')) +
+            sum(len(k) + len(str(v.get('StringValue', v.get('BinaryValue', '')))) for k, v in attributes.items()))
+
+
+def _batches(entries):
+    batch, batch_bytes = [], 0
+    for entry in entries:
+        size = _entry_size(entry)
+        if batch and (len(batch) == BATCH_SIZE or batch_bytes + size > BATCH_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _publish_sns_batch(conn, topic, messages):
+    """ Publish `messages`, a list of (message, publish kwargs) pairs, to `topic` with PublishBatch,
+    in batches of up to 10 messages (and 256KB). Entries SNS failed on its side are retried with
+    jittered backoff; entries rejected as the sender's fault are not.
+
+    Returns:
+        list: the published messages, in the given order
+    """
+    topic_arn = _topic_arn(conn, topic)
+    logger.debug(f'Publishing {len(messages)} messages to {topic_arn} in batches')
+
+    entries = [{'Message': _prepare_message(conn, message), **kwargs} for message, kwargs in messages]
+    failures = []
+    for batch in _batches(entries):
+        pending = {str(i): entry for i, entry in enumerate(batch)}
+        for attempt in range(BATCH_RETRIES + 1):
+            response = conn['sns'].publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=[{'Id': i, **entry} for i, entry in pending.items()],
+            )
+            failed = response.get('Failed', [])
+            retryable = [f for f in failed if not f.get('SenderFault')]
+            failures.extend(f for f in failed if f.get('SenderFault'))
+            if not retryable:
+                break
+            if attempt == BATCH_RETRIES:
+                failures.extend(retryable)
+                break
+            logger.warning(f'Retrying {len(retryable)} of {len(pending)} messages to {topic_arn}')
+            pending = {f['Id']: pending[f['Id']] for f in retryable}
+            time.sleep(random.uniform(0, BATCH_BACKOFF * 2 ** attempt))
+
+    if failures:
+        raise PublishBatchException(f'Failed to publish {len(failures)} messages to {topic_arn}.', failures)
+
+    return [message for message, _ in messages]
+
+
 EVENT = Schema({
     'type': str,
     'detail': dict
@@ -48,40 +198,161 @@ _validate_events = Schema({
 })
 
 
-def publish_events(conn, events):
+def _event_kwargs(event):
+    return {
+        'Subject': event['type'],
+        'MessageAttributes': {
+            'message_type': {
+                'DataType': 'String',
+                'StringValue': event['type']
+            }
+        },
+    }
+
+
+def _fan_out(publish_topic, items, max_concurrency=None):
+    """ Call publish_topic(topic, value) for each (topic, value) in items. With max_concurrency > 1
+    different topics are published in parallel on a bounded thread pool; each topic's own messages
+    are still published in order by a single thread. In that mode errors are collected and raised
+    together as a PublishException once every topic has been attempted.
+
+    Returns:
+        list: publish_topic results, in the order of items
+    """
+    if not max_concurrency or max_concurrency < 2 or len(items) < 2:
+        return [publish_topic(topic, value) for topic, value in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+        futures = [(topic, executor.submit(publish_topic, topic, value)) for topic, value in items]
+
+    results, errors = [], {}
+    for topic, future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:
+            logger.exception(err)
+            errors[topic] = err
+    if errors:
+        raise PublishException(f'Failed to publish to {len(errors)} of {len(items)} topics.', errors)
+    return results
+
+
+def publish_events(conn, events, max_concurrency=None):
+    """ Publish events, a dict of topic -> list of events (see EVENT). Topics with more than one
+    event are published with SNS PublishBatch.
+
+    Args:
+        conn (dict): see `conn`
+        events (dict): topic -> list of events
+        max_concurrency (int): optionally publish to up to this many topics in parallel
+
+    Returns:
+        list: the published event details, in order
+    """
     _validate_events(events)
     logger.debug(f'Publishing {events}')
 
+    def publish_topic(topic, events_for_topic):
+        messages = [(event['detail'], _event_kwargs(event)) for event in events_for_topic]
+        if len(messages) > 1:
+            return _publish_sns_batch(conn, topic, messages)
+        return [_publish_sns_message(conn, topic, message, **kwargs) for message, kwargs in messages]
+
     published_events = []
-    for topic, events_for_topic in events.items():
-        for event in events_for_topic:
-            event = _publish_sns_message(conn, topic, event['detail'],
-                                         Subject=event['type'],
-                                         MessageAttributes={
-                                            'message_type': {
-                                                'DataType': 'String',
-                                                'StringValue': event['type']
-                                            }
-                                        })
-            published_events.append(event)
+    for published in _fan_out(publish_topic, list(events.items()), max_concurrency):
+        published_events.extend(published)
 
     return published_events
 
 
-def publish(conn, messages):
+def publish(conn, messages, max_concurrency=None):
+    """ Publish messages, a dict of topic -> message.
+
+    Args:
+        conn (dict): see `conn`
+        messages (dict): topic -> message (str or json serializable)
+        max_concurrency (int): optionally publish to up to this many topics in parallel
+
+    Returns:
+        list: the published messages, in order
+    """
     logger.debug(f'Publishing {messages}')
 
-    published_messages = []
-    for topic, message in messages.items():
-        message = _publish_sns_message(conn, topic, messages[topic])
-        published_messages.append(message)
+    def publish_topic(topic, message):
+        return _publish_sns_message(conn, topic, message)
+
+    return _fan_out(publish_topic, list(messages.items()), max_concurrency)
+
+
+def defer(fn, *args, **kwargs):
+    """ Run a publish function, e.g. `publish` or `publish_events`, on a background thread pool that
+    is shared by (and survives) invocations. Callers must `join` the returned future before the
+    invocation ends: a frozen lambda container does not run background threads.
+
+    Returns:
+        concurrent.futures.Future
+    """
+    global _deferred_executor
+    if _deferred_executor is None:
+        with _deferred_lock:
+            if _deferred_executor is None:
+                _deferred_executor = ThreadPoolExecutor(max_workers=DEFERRED_WORKERS,
+                                                        thread_name_prefix='pyfaaster-publish')
+    return _deferred_executor.submit(fn, *args, **kwargs)
+
+
+def join(deferred, timeout=None):
+    """ Wait up to `timeout` seconds for deferred publishes.
 
-    return published_messages
+    Args:
+        deferred (list): (targets, future) pairs, targets describing what the future publishes
+        timeout (float): seconds to wait; None waits until all are done
+
+    Returns:
+        dict: {'published': [targets], 'failed': [(targets, error)], 'dropped': [targets]}
+    """
+    _, not_done = concurrent.futures.wait([future for _, future in deferred], timeout=timeout)
+    report = {'published': [], 'failed': [], 'dropped': []}
+    for targets, future in deferred:
+        if future in not_done:
+            future.cancel()
+            report['dropped'].append(targets)
+        elif future.exception():
+            report['failed'].append((targets, future.exception()))
+        else:
+            report['published'].append(targets)
+    return report
+
+
+def claim_check(bucket, threshold=CLAIM_CHECK_THRESHOLD, compress=False, prefix='claim-check/', client=None):
+    """ Claim check settings for `conn`: serialized messages larger than `threshold` bytes are
+    written to `bucket` (optionally gzip compressed) and a small pointer message is published
+    instead. `resolve_claim_check` (used by the subscriber decorator) turns the pointer back into
+    the original message. Objects are not deleted on read; expire them with a bucket lifecycle rule.
+
+    Args:
+        bucket (str): S3 bucket for oversized messages
+        threshold (int): size in bytes above which messages are offloaded
+        compress (bool): gzip offloaded messages
+        prefix (str): S3 key prefix for offloaded messages
+        client: optional S3 client
+
+    Returns:
+        dict: claim check settings
+    """
+    return {
+        'bucket': bucket,
+        'threshold': threshold,
+        'compress': compress,
+        'prefix': prefix,
+        's3': client,
+    }
 
 
-def conn(region, account_id, namespace, client=None):
+def conn(region, account_id, namespace, client=None, claim_check=None):
     return {
         'namespace': namespace,
         'topic_arn_prefix': f'arn:aws:sns:{region}:{account_id}:',
-        'sns': client or boto3.client('sns'),
+        'sns': client or clients.client('sns'),
+        'claim_check': claim_check,
     }
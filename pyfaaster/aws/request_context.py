@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Request scoped views of a lambda event, built once per event and shared by every decorator and
+helper that needs them (instead of each one re-parsing the event).
+"""
+
+import collections.abc
+import contextvars
+
+import pyfaaster.common.serialization as serialization
+
+_UNPARSED = object()
+
+
+class Headers(collections.abc.Mapping):
+    """Read-only, case-insensitive view of an event's `headers` and `multiValueHeaders`.
+
+    Indexing returns a single value (the `headers` value if present, else the last of the
+    `multiValueHeaders` values); `get_all` returns every value of a header.
+    """
+
+    __slots__ = ('_single', '_multi')
+
+    def __init__(self, headers=None, multi_value_headers=None):
+        self._single = {}
+        self._multi = {}
+        for name, values in (multi_value_headers or {}).items():
+            if values:
+                self._multi.setdefault(str(name).lower(), []).extend(values)
+        for name, value in (headers or {}).items():
+            self._single[str(name).lower()] = value
+
+    def __getitem__(self, name):
+        key = str(name).lower()
+        if key in self._single:
+            return self._single[key]
+        return self._multi[key][-1]
+
+    def __iter__(self):
+        return iter(self._single.keys() | self._multi.keys())
+
+    def __len__(self):
+        return len(self._single.keys() | self._multi.keys())
+
+    def get_all(self, name):
+        """All values of header `name` (case-insensitive), or [] if it is missing."""
+        key = str(name).lower()
+        if key in self._multi:
+            return list(self._multi[key])
+        if key in self._single:
+            return [self._single[key]]
+        return []
+
+    def __repr__(self):
+        return f'Headers({dict(self)})'
+
+
+class RequestContext:
+    """Lazily built views of a single event. Views reflect the event as it was when first accessed."""
+
+    __slots__ = ('event', '_headers', '_body')
+
+    def __init__(self, event):
+        self.event = event
+        self._headers = None
+        self._body = _UNPARSED
+
+    @property
+    def has_headers(self):
+        return isinstance(self.event.get('headers'), dict) or isinstance(self.event.get('multiValueHeaders'), dict)
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            headers = self.event.get('headers')
+            multi_value_headers = self.event.get('multiValueHeaders')
+            self._headers = Headers(headers if isinstance(headers, dict) else None,
+                                    multi_value_headers if isinstance(multi_value_headers, dict) else None)
+        return self._headers
+
+    def body(self, backend=None):
+        """The event's JSON body, parsed once (with the first caller's backend, see serialization.loads)."""
+        if self._body is _UNPARSED:
+            self._body = serialization.loads(self.event.get('body'), backend=backend)
+        return self._body
+
+
+_current = contextvars.ContextVar('pyfaaster_request_context', default=None)
+
+
+def get(event):
+    """ Get the RequestContext of `event`. It is cached (per thread/task) for as long as the same
+    event object is being handled, so every caller shares the views already built.
+
+    Args:
+        event (dict): lambda event
+
+    Returns:
+        RequestContext
+    """
+    context = _current.get()
+    if context is None or context.event is not event:
+        context = RequestContext(event)
+        _current.set(context)
+    return context
+
+
+def headers(event):
+    """ Case-insensitive Headers view of `event`, see get.
+
+    Args:
+        event (dict): lambda event
+
+    Returns:
+        Headers
+    """
+    return get(event).headers
+
+
+def body(event, backend=None):
+    """ The parsed JSON body of `event`, see get. It is parsed only once however many decorators
+    and handlers ask for it, so treat it as read-only.
+
+    Args:
+        event (dict): lambda event
+        backend (str): json backend to use if the body has not been parsed yet, see serialization.loads
+
+    Returns:
+        the deserialized body
+
+    Raises:
+        simplejson.JSONDecodeError: if the body is not valid JSON
+    """
+    return get(event).body(backend)
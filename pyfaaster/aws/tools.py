@@ -10,6 +10,8 @@ import logging
 import os
 import sys
 
+import pyfaaster.aws.request_context as request_context
+
 
 def running_in_aws():
     return bool(os.environ.get('AWS_EXECUTION_ENV'))
@@ -84,13 +86,13 @@ def get_region(context):
 
 
 def get_client_details(event):
-    headers = event.get('headers')
-    try:
+    context = request_context.get(event)
+    if context.has_headers:
         return {
-            "Client": f"{headers.get('User-Agent')}",
-            "Source IP": f"{headers.get('X-Forwarded-For')}",
+            "Client": f"{context.headers.get('User-Agent')}",
+            "Source IP": f"{context.headers.get('X-Forwarded-For')}",
         }
-    except (AttributeError, KeyError):
+    else:
         try:
             # Yes goddamn AWS has a typo in what they return depending on event source
             event_source = str(event['Records'][0].get('eventSource', event['Records'][0].get('EventSource')))
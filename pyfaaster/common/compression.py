@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+HTTP content-encoding negotiation and compression. gzip is always available; brotli is used when the
+optional brotli package is installed (pip install pyfaaster[brotli]).
+"""
+
+import functools
+import gzip
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def encodings():
+    """Supported content-encodings, most preferred first."""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+@functools.lru_cache(maxsize=128)
+def negotiate(accept_encoding):
+    """ Pick the content-encoding to use for a request's Accept-Encoding header.
+
+    E.g.,
+    >>> negotiate('gzip, deflate')
+    'gzip'
+    >>> negotiate('gzip;q=0, identity')
+
+    Args:
+        accept_encoding (str): Accept-Encoding request header value
+
+    Returns:
+        str: a supported encoding the client accepts (the one with the highest q, ties going to the
+            one we prefer), or None if the body should not be encoded
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    candidates = [(weights.get(e, weights.get('*', 0.0)), -i, e) for i, e in enumerate(encodings())]
+    weight, _, encoding = max(candidates)
+    return encoding if weight > 0 else None
+
+
+def compress(data, encoding):
+    """ Compress bytes with the given content-encoding.
+
+    Args:
+        data (bytes): data to compress
+        encoding (str): 'gzip' or 'br'
+
+    Returns:
+        bytes: compressed data
+    """
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if encoding == 'br' and brotli:
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    raise ValueError(f'Unsupported content-encoding {encoding}.')
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+JSON (de)serialization with a pluggable backend: orjson, which is much faster on large documents but
+is an optional dependency (pip install pyfaaster[orjson]), or simplejson, used when orjson is not installed.
+"""
+
+import decimal
+import enum
+import os
+
+import simplejson as json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKENDS = ('auto', 'orjson', 'simplejson')
+DEFAULT_BACKEND = os.environ.get('PYFAASTER_JSON_BACKEND', 'auto')
+
+
+def _backend(backend):
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f'Unsupported json backend {backend}; expected one of {BACKENDS}.')
+    if backend == 'auto':
+        return 'orjson' if orjson else 'simplejson'
+    if backend == 'orjson' and not orjson:
+        raise ValueError('The orjson json backend is not installed.')
+    return backend
+
+
+def loads(s, backend=None):
+    """ Deserialize the JSON document `s`.
+
+    orjson is stricter than simplejson (e.g. it rejects NaN and integers wider than 64 bits), so
+    documents it cannot parse are retried with simplejson. Either way, invalid documents raise
+    simplejson.JSONDecodeError.
+
+    Args:
+        s (str|bytes): JSON document
+        backend (str): 'simplejson', 'orjson' or 'auto' (orjson if installed); defaults to
+            DEFAULT_BACKEND, i.e. the PYFAASTER_JSON_BACKEND environment variable or 'auto'
+
+    Returns:
+        the deserialized document
+    """
+    if _backend(backend) == 'orjson' and isinstance(s, (str, bytes, bytearray, memoryview)):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s)
+
+
+def _iterable_default(iterables):
+    # Shared by both encoders: iterables (sets, generators, ...) become lists, as with simplejson's
+    # iterable_as_array, and are remembered, so a document that orjson gives up on can be re-encoded
+    # with simplejson without losing already consumed generators.
+    def default(o):
+        if id(o) in iterables:
+            return iterables[id(o)]
+        if isinstance(o, enum.Enum):
+            return o.value
+        try:
+            iterator = iter(o)
+        except TypeError:
+            raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+        iterables[id(o)] = list(iterator)
+        return iterables[id(o)]
+
+    return default
+
+
+def _orjson_default(iterables):
+    default = _iterable_default(iterables)
+    fragment = getattr(orjson, 'Fragment', None)
+
+    def orjson_default(o):
+        if isinstance(o, tuple) and hasattr(o, '_asdict'):
+            return o._asdict()
+        if isinstance(o, decimal.Decimal):
+            if fragment is not None:
+                return fragment(str(o))
+            # without Fragment (orjson < 3.9) only Decimals with an equal int or float are encoded
+            if o.is_finite() and o == o.to_integral_value():
+                return int(o)
+            if o.is_finite() and decimal.Decimal(repr(float(o))) == o:
+                return float(o)
+            raise TypeError(f'Decimal {o} has no exact float representation')
+        return default(o)
+
+    return orjson_default
+
+
+def dumps(obj, backend=None):
+    """ Serialize `obj` to a JSON string, the way pyfaaster always has, i.e. like
+    simplejson.dumps(obj, iterable_as_array=True): sets, generators and other iterables are
+    arrays, namedtuples are objects, Decimals (e.g. from DynamoDB) are exact numbers and non-str
+    keys are coerced to str. Enums are serialized as their value, like utils.EnumEncoder.
+
+    The orjson backend is several times faster but writes compact, non ASCII-escaped JSON (the
+    same document, different bytes; e.g. Decimal('1.10') may be written as 1.1 by orjson < 3.9).
+    Documents it cannot encode exactly (e.g. Decimals that are not equal to any float, integers
+    wider than 64 bits) are encoded with simplejson instead.
+
+    Args:
+        obj: the object to serialize
+        backend (str): 'simplejson', 'orjson' or 'auto', see loads
+
+    Returns:
+        str: JSON document
+
+    Raises:
+        TypeError: if obj contains something that is not JSON serializable
+    """
+    iterables = {}
+    if _backend(backend) == 'orjson':
+        try:
+            return orjson.dumps(obj, default=_orjson_default(iterables), option=orjson.OPT_NON_STR_KEYS).decode()
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, default=_iterable_default(iterables))
@@ -83,6 +83,10 @@ setup(
     packages=find_packages(exclude=['tests*']),
 
     install_requires=REQUIRED,
+    extras_require={
+        'brotli': ['brotli>=1.0.9'],
+        'orjson': ['orjson>=3.6.0'],
+    },
     include_package_data=True,
     license='BSD',
     classifiers=[
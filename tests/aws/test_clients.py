@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import botocore.config
+import pytest
+
+import pyfaaster.aws.clients as clients
+import pyfaaster.aws.configuration as conf
+import pyfaaster.aws.deadline as deadline
+import pyfaaster.aws.publish as pub
+
+
+@pytest.fixture(scope='function')
+def registry():
+    clients.invalidate()
+    yield clients._clients
+    clients.invalidate()
+
+
+@pytest.mark.unit
+def test_client_is_reused(registry):
+    s3 = clients.client('s3', region_name='us-east-1')
+    assert clients.client('s3', region_name='us-east-1') is s3
+    assert len(registry) == 1
+
+
+@pytest.mark.unit
+def test_client_keyed_by_region_config_and_credentials(registry):
+    s3 = clients.client('s3', region_name='us-east-1')
+    assert clients.client('s3', region_name='us-west-2') is not s3
+    assert clients.client('s3', region_name='us-east-1', config=botocore.config.Config(read_timeout=1)) is not s3
+    assert clients.client('s3', region_name='us-east-1',
+                          aws_access_key_id='AKIA', aws_secret_access_key='secret') is not s3
+    assert clients.client('s3', region_name='us-east-1',
+                          config=botocore.config.Config(read_timeout=1)) is clients.client(
+        's3', region_name='us-east-1', config=botocore.config.Config(read_timeout=1))
+    assert len(registry) == 4
+
+
+@pytest.mark.unit
+def test_invalidate(registry):
+    s3 = clients.client('s3', region_name='us-east-1')
+    sns = clients.client('sns', region_name='us-east-1')
+
+    clients.invalidate('s3')
+    assert clients.client('s3', region_name='us-east-1') is not s3
+    assert clients.client('sns', region_name='us-east-1') is sns
+
+    clients.invalidate()
+    assert not registry
+
+
+@pytest.mark.unit
+def test_conns_share_clients(registry):
+    assert conf.conn()['client'] is conf.conn('arn')['client']
+    assert pub.conn('us-east-1', '123456789012', 'ns')['sns'] is pub.conn('us-east-1', '123456789012', 'ns')['sns']
+
+
+@pytest.mark.unit
+def test_client_timeouts_follow_deadline(registry):
+    s3 = clients.client('s3', region_name='us-east-1')
+
+    with deadline.scope(deadline.Deadline(3500)):
+        short = clients.client('s3', region_name='us-east-1', config=botocore.config.Config(retries={'max_attempts': 1}))
+        assert short.meta.config.read_timeout == 2
+        assert short.meta.config.connect_timeout == 2
+        assert short.meta.config.retries['total_max_attempts'] == 2
+        assert clients.client('s3', region_name='us-east-1') is not s3
+
+    assert clients.client('s3', region_name='us-east-1') is s3
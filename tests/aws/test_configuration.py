@@ -2,6 +2,7 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 from io import BytesIO
+import mock
 
 import botocore.session
 from botocore.stub import Stubber
@@ -10,6 +11,7 @@ import simplejson as json
 import pytest
 
 import pyfaaster.aws.configuration as conf
+import pyfaaster.common.serialization as serialization
 
 
 @pytest.mark.unit
@@ -34,7 +36,7 @@ def test_configuration():
         'RequestCharged': 'requester'
     }
 
-    put_parameters = {'Body': json.dumps(settings),
+    put_parameters = {'Body': serialization.dumps(settings),
                       'Bucket': bucket_name,
                       'Key': file_name,
                       'SSEKMSKeyId': 'arn:aws:kms:region:account_id:key/guid',
@@ -75,7 +77,7 @@ def test_configuration_no_encrypt_key():
         'RequestCharged': 'requester'
     }
 
-    put_parameters = {'Body': json.dumps(settings),
+    put_parameters = {'Body': serialization.dumps(settings),
                       'Bucket': bucket_name,
                       'Key': file_name,
                       'ServerSideEncryption': 'AES256'}
@@ -116,7 +118,7 @@ def test_read_only():
         'RequestCharged': 'requester'
     }
 
-    put_parameters = {'Body': json.dumps(settings),
+    put_parameters = {'Body': serialization.dumps(settings),
                       'Bucket': bucket_name,
                       'Key': file_name,
                       'SSEKMSKeyId': 'arn:aws:kms:region:account_id:key/guid',
@@ -141,3 +143,121 @@ def test_read_only():
         assert conf.read_only_cache.currsize == 1
         # verify cache has the right data
         assert conf.read_only_cache[('bucket', 'conf.json')] == settings
+
+
+@pytest.fixture(scope='function')
+def settings_cache():
+    conf.invalidate()
+    conf.cache_stats.clear()
+    yield conf.settings_cache
+    conf.invalidate()
+
+
+def _get_response(settings, etag):
+    data = json.dumps(settings).encode('utf-8')
+    return {'Body': StreamingBody(raw_stream=BytesIO(data), content_length=len(data)), 'ETag': etag}
+
+
+@pytest.mark.unit
+def test_load_cached_hit_within_ttl(settings_cache):
+    settings = {'setting_1': 'foo'}
+    s3 = botocore.session.get_session().create_client('s3')
+    conn = conf.conn(client=s3)
+
+    with Stubber(s3) as stubber:
+        stubber.add_response('get_object', _get_response(settings, '"v1"'), {'Bucket': 'bucket', 'Key': 'conf.json'})
+        assert conf.load_cached(conn, 'bucket', 'conf.json', ttl=60) == settings
+        # second call must not reach S3; the Stubber would raise on an unexpected call
+        assert conf.load_cached(conn, 'bucket', 'conf.json', ttl=60) == settings
+        stubber.assert_no_pending_responses()
+
+    assert conf.cache_stats['misses'] == 1
+    assert conf.cache_stats['hits'] == 1
+
+
+@pytest.mark.unit
+def test_load_cached_returns_copies(settings_cache):
+    settings = {'setting_1': 'foo'}
+    s3 = botocore.session.get_session().create_client('s3')
+    conn = conf.conn(client=s3)
+
+    with Stubber(s3) as stubber:
+        stubber.add_response('get_object', _get_response(settings, '"v1"'), {'Bucket': 'bucket', 'Key': 'conf.json'})
+        conf.load_cached(conn, 'bucket', 'conf.json')['setting_1'] = 'mutated'
+        assert conf.load_cached(conn, 'bucket', 'conf.json') == settings
+
+
+@pytest.mark.unit
+def test_load_cached_revalidates_with_etag(settings_cache):
+    settings = {'setting_1': 'foo'}
+    s3 = botocore.session.get_session().create_client('s3')
+    conn = conf.conn(client=s3)
+
+    with Stubber(s3) as stubber:
+        stubber.add_response('get_object', _get_response(settings, '"v1"'), {'Bucket': 'bucket', 'Key': 'conf.json'})
+        stubber.add_client_error('get_object', service_error_code='304', service_message='Not Modified',
+                                 http_status_code=304,
+                                 expected_params={'Bucket': 'bucket', 'Key': 'conf.json', 'IfNoneMatch': '"v1"'})
+        changed = {'setting_1': 'bar'}
+        stubber.add_response('get_object', _get_response(changed, '"v2"'),
+                             {'Bucket': 'bucket', 'Key': 'conf.json', 'IfNoneMatch': '"v1"'})
+
+        assert conf.load_cached(conn, 'bucket', 'conf.json', ttl=0) == settings
+        assert conf.load_cached(conn, 'bucket', 'conf.json', ttl=0) == settings
+        assert conf.load_cached(conn, 'bucket', 'conf.json', ttl=0) == changed
+
+    assert conf.cache_stats['misses'] == 2
+    assert conf.cache_stats['revalidations'] == 1
+    assert settings_cache[('bucket', 'conf.json')]['etag'] == '"v2"'
+
+
+@pytest.mark.unit
+def test_load_cached_sees_own_save(settings_cache):
+    settings = {'setting_1': 'foo'}
+    updated = {'setting_1': 'bar'}
+    s3 = botocore.session.get_session().create_client('s3')
+    conn = conf.conn(client=s3)
+
+    with Stubber(s3) as stubber:
+        stubber.add_response('get_object', _get_response(settings, '"v1"'), {'Bucket': 'bucket', 'Key': 'conf.json'})
+        stubber.add_response('put_object', {'ETag': '"v2"'},
+                             {'Body': serialization.dumps(updated), 'Bucket': 'bucket', 'Key': 'conf.json',
+                              'ServerSideEncryption': 'AES256'})
+
+        assert conf.load_cached(conn, 'bucket', 'conf.json') == settings
+        conf.save(conn, 'bucket', 'conf.json', updated)
+        assert conf.load_cached(conn, 'bucket', 'conf.json') == updated
+
+    assert settings_cache[('bucket', 'conf.json')]['etag'] == '"v2"'
+
+
+@pytest.mark.unit
+def test_load_cached_create(settings_cache):
+    s3 = botocore.session.get_session().create_client('s3')
+    conn = conf.conn(client=s3)
+
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+        stubber.add_response('put_object', {'ETag': '"v1"'},
+                             {'Body': serialization.dumps({}), 'Bucket': 'bucket', 'Key': 'conf.json',
+                              'ServerSideEncryption': 'AES256'})
+        assert conf.load_cached(conn, 'bucket', 'conf.json', create=True) == {}
+        assert conf.load_cached(conn, 'bucket', 'conf.json', create=True) == {}
+
+    assert conf.cache_stats['hits'] == 1
+
+
+@pytest.mark.unit
+def test_invalidate(settings_cache):
+    conf.save(conf.conn(client=mock_client()), 'bucket', 'a.json', {})
+    conf.save(conf.conn(client=mock_client()), 'bucket', 'b.json', {})
+    conf.invalidate('bucket', 'a.json')
+    assert list(settings_cache) == [('bucket', 'b.json')]
+    conf.invalidate()
+    assert not settings_cache
+
+
+def mock_client():
+    s3 = mock.MagicMock()
+    s3.put_object.return_value = {'ETag': '"v1"'}
+    return s3
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import threading
+import time
+
+import pytest
+
+import pyfaaster.aws.deadline as deadline
+
+
+class LambdaContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.mark.unit
+def test_from_context():
+    current = deadline.from_context(LambdaContext(3000), reserve_ms=500)
+
+    assert 2900 < current.remaining_ms() <= 3000
+    assert 2400 < current.budget_ms() <= 2500
+    assert not current.expired()
+    current.check()
+    assert deadline.from_context(object()) is None
+
+
+@pytest.mark.unit
+def test_check_expired():
+    current = deadline.Deadline(100, reserve_ms=500)
+
+    assert current.expired()
+    with pytest.raises(deadline.DeadlineExceededException) as err:
+        current.check()
+    assert err.value.statusCode == 503
+
+
+@pytest.mark.unit
+def test_scope():
+    outer, inner = deadline.Deadline(10000), deadline.Deadline(5000)
+    assert deadline.current() is None
+
+    with deadline.scope(outer):
+        assert deadline.current() is outer
+        with deadline.scope(inner):
+            assert deadline.current() is inner
+        assert deadline.current() is outer
+    assert deadline.current() is None
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('remaining_ms, timeout', [
+    (100000, 60),
+    (25500, 20),
+    (3500, 2),
+    (600, 0.25),
+])
+def test_client_config(remaining_ms, timeout):
+    assert deadline.client_config() is None
+
+    with deadline.scope(deadline.Deadline(remaining_ms, reserve_ms=500)):
+        config = deadline.client_config()
+
+    assert config.connect_timeout == timeout
+    assert config.read_timeout == timeout
+
+
+@pytest.mark.unit
+def test_alarm():
+    with pytest.raises(deadline.DeadlineExceededException):
+        with deadline.alarm(deadline.Deadline(600, reserve_ms=500)):
+            time.sleep(1)
+
+    with deadline.alarm(deadline.Deadline(1000, reserve_ms=500)):
+        pass
+    time.sleep(0.6)
+
+
+@pytest.mark.unit
+def test_alarm_outside_main_thread():
+    errors = []
+
+    def run():
+        try:
+            with deadline.alarm(deadline.Deadline(550, reserve_ms=500)):
+                time.sleep(0.1)
+        except Exception as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert not errors
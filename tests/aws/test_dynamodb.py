@@ -3,7 +3,15 @@
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
 
+import inspect
+import time
+import timeit
+
+import boto3
 import botocore.session
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+import mock
+import moto
 import pytest
 from botocore.stub import Stubber
 
@@ -50,3 +58,238 @@ def test_update_item_from_dict_reserved_words():
         attributes = {'AGGREGATE': 'Lloyd'}
         item = dyn.update_item_from_dict('test_table', {'id': '1'}, attributes, client)
         assert item == {'id': '1', 'name': 'Harry', 'AGGREGATE': 'Lloyd'}
+
+
+@pytest.mark.unit
+def test_update_item_from_dict_template_cached():
+    client = mock.MagicMock()
+    client.update_item.return_value = {'Attributes': {'id': {'S': '1'}}}
+    dyn._update_template.cache_clear()
+
+    dyn.update_item_from_dict('test_table', {'id': '1'}, {'b-b': 1, 'a': 'x'}, client)
+    dyn.update_item_from_dict('test_table', {'id': '2'}, {'a': 'y', 'b-b': 2}, client)
+
+    assert dyn._update_template.cache_info().hits == 1
+    assert client.update_item.call_args.kwargs == {
+        'TableName': 'test_table',
+        'Key': {'id': {'S': '2'}},
+        'UpdateExpression': 'SET #a = :a, #bb = :bb',
+        'ExpressionAttributeNames': {'#a': 'a', '#bb': 'b-b'},
+        'ExpressionAttributeValues': {':a': {'S': 'y'}, ':bb': {'N': '2'}},
+        'ReturnValues': 'ALL_NEW',
+    }
+
+
+@pytest.mark.unit
+def test_update_item_from_dict_placeholder_collision():
+    client = mock.MagicMock()
+
+    dyn.update_item_from_dict('test_table', {'id': '1'}, {'best-friend': 'Lloyd', 'bestfriend': 'Harry'}, client)
+
+    kwargs = client.update_item.call_args.kwargs
+    assert kwargs['UpdateExpression'] == 'SET #bestfriend = :bestfriend, #bestfriend_ = :bestfriend_'
+    assert kwargs['ExpressionAttributeNames'] == {'#bestfriend': 'best-friend', '#bestfriend_': 'bestfriend'}
+    assert kwargs['ExpressionAttributeValues'] == {':bestfriend': {'S': 'Lloyd'}, ':bestfriend_': {'S': 'Harry'}}
+
+
+def _uncached_update_item_from_dict(table_name, key, dictionary, client):
+    # update_item_from_dict as it was before serializers and update expressions were cached
+    serializer, deserializer = TypeSerializer(), TypeDeserializer()
+    working_data = {k: [dyn.pattern.sub("", k), v] for k, v in dictionary.items()}
+    updates_string = ', '.join([f'#{v[0]} = :{v[0]}' for v in working_data.values()])
+    item = client.update_item(
+        TableName=table_name,
+        Key={k: serializer.serialize(v) for k, v in key.items()},
+        UpdateExpression=f'SET {updates_string}',
+        ExpressionAttributeNames={f'#{v[0]}': k for k, v in working_data.items()},
+        ExpressionAttributeValues={f':{v[0]}': serializer.serialize(v[1]) for k, v in working_data.items()},
+        ReturnValues='ALL_NEW',
+    )
+    return {k: deserializer.deserialize(v) for k, v in item.get('Attributes', {}).items()}
+
+
+@pytest.mark.performance
+def test_update_item_from_dict_benchmark():
+    class Client:
+        def update_item(self, **kwargs):
+            return {'Attributes': kwargs['Key']}
+
+    client = Client()
+    attributes = {f'attribute-{i}': f'value-{i}' for i in range(10)}
+
+    def run(update):
+        return min(timeit.repeat(lambda: update('test_table', {'id': '1'}, attributes, client), number=2000, repeat=5))
+
+    uncached, cached = run(_uncached_update_item_from_dict), run(dyn.update_item_from_dict)
+    print(f'update_item_from_dict: uncached {uncached / 2:.3f}ms, cached {cached / 2:.3f}ms per call')
+
+    assert cached < uncached
+
+
+@pytest.fixture(scope='function')
+def table():
+    with moto.mock_aws():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(TableName='test_table',
+                            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+                            BillingMode='PAY_PER_REQUEST')
+        yield client
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_batch_put_and_get_items(table, max_concurrency):
+    items = [{'id': str(i), 'count': i, 'tags': {'a', 'b'}} for i in range(60)]
+
+    assert dyn.batch_put_items('test_table', items, client=table, max_concurrency=max_concurrency) == 60
+    assert table.scan(TableName='test_table', Select='COUNT')['Count'] == 60
+
+    keys = [{'id': str(i)} for i in range(130)] + [{'id': '1'}]
+    found = dyn.batch_get_items('test_table', keys, client=table, max_concurrency=max_concurrency)
+    assert sorted(found, key=lambda item: int(item['id'])) == items
+
+
+@pytest.mark.unit
+def test_batch_get_items_projection(table):
+    dyn.batch_put_items('test_table', [{'id': '1', 'count': 1}], client=table)
+
+    assert dyn.batch_get_items('test_table', [{'id': '1'}], client=table, projection='id') == [{'id': '1'}]
+
+
+@pytest.mark.unit
+def test_batch_put_items_retries_unprocessed(mocker):
+    mocker.patch.object(dyn, 'BATCH_BACKOFF', 0)
+    client = mock.MagicMock()
+    unprocessed = {'test_table': [{'PutRequest': {'Item': {'id': {'S': '1'}}}}]}
+    client.batch_write_item.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}]
+
+    assert dyn.batch_put_items('test_table', [{'id': '0'}, {'id': '1'}], client=client) == 2
+    assert client.batch_write_item.call_args_list[1].kwargs == {'RequestItems': unprocessed}
+
+
+@pytest.mark.unit
+def test_batch_put_items_gives_up(mocker):
+    mocker.patch.object(dyn, 'BATCH_BACKOFF', 0)
+    client = mock.MagicMock()
+    client.batch_write_item.return_value = {
+        'UnprocessedItems': {'test_table': [{'PutRequest': {'Item': {'id': {'S': '1'}}}}]}}
+
+    with pytest.raises(dyn.BatchException) as err:
+        dyn.batch_put_items('test_table', [{'id': '0'}, {'id': '1'}], client=client)
+
+    assert err.value.unprocessed == [{'id': '1'}]
+    assert client.batch_write_item.call_count == dyn.BATCH_RETRIES + 1
+
+
+@pytest.mark.unit
+def test_batch_get_items_retries_unprocessed(mocker):
+    mocker.patch.object(dyn, 'BATCH_BACKOFF', 0)
+    client = mock.MagicMock()
+    client.batch_get_item.side_effect = [
+        {'Responses': {'test_table': [{'id': {'S': '0'}}]},
+         'UnprocessedKeys': {'test_table': {'Keys': [{'id': {'S': '1'}}], 'ConsistentRead': True}}},
+        {'Responses': {'test_table': [{'id': {'S': '1'}}]}},
+    ]
+
+    items = dyn.batch_get_items('test_table', [{'id': '0'}, {'id': '1'}], client=client, consistent_read=True)
+
+    assert items == [{'id': '0'}, {'id': '1'}]
+    assert client.batch_get_item.call_args_list[0].kwargs == {
+        'RequestItems': {'test_table': {'ConsistentRead': True, 'Keys': [{'id': {'S': '0'}}, {'id': {'S': '1'}}]}}}
+
+
+@pytest.mark.unit
+def test_batch_get_items_gives_up(mocker):
+    mocker.patch.object(dyn, 'BATCH_BACKOFF', 0)
+    client = mock.MagicMock()
+    client.batch_get_item.return_value = {'UnprocessedKeys': {'test_table': {'Keys': [{'id': {'S': '1'}}]}}}
+
+    with pytest.raises(dyn.BatchException) as err:
+        dyn.batch_get_items('test_table', [{'id': '1'}], client=client)
+
+    assert err.value.unprocessed == [{'id': '1'}]
+
+
+@pytest.fixture(scope='function')
+def sorted_table():
+    with moto.mock_aws():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(TableName='sorted_table',
+                            KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'},
+                                       {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+                            AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'},
+                                                  {'AttributeName': 'sk', 'AttributeType': 'N'}],
+                            BillingMode='PAY_PER_REQUEST')
+        dyn.batch_put_items('sorted_table', [{'pk': pk, 'sk': i} for pk in ('a', 'b') for i in range(25)],
+                            client=client)
+        yield client
+
+
+@pytest.mark.unit
+def test_query_items_paginates(sorted_table):
+    items = dyn.query_items('sorted_table', '#pk = :pk AND sk >= :sk', {':pk': 'a', ':sk': 5}, client=sorted_table,
+                            ExpressionAttributeNames={'#pk': 'pk'}, Limit=7)
+
+    assert inspect.isgenerator(items)
+    assert list(items) == [{'pk': 'a', 'sk': i} for i in range(5, 25)]
+
+
+@pytest.mark.unit
+def test_query_items_descending(sorted_table):
+    items = dyn.query_items('sorted_table', 'pk = :pk', {':pk': 'b'}, client=sorted_table, ScanIndexForward=False,
+                            Limit=10)
+
+    assert [item['sk'] for item in items] == list(range(24, -1, -1))
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('segments', [1, 3])
+def test_scan_items(sorted_table, segments):
+    items = list(dyn.scan_items('sorted_table', client=sorted_table, segments=segments, Limit=4))
+
+    assert sorted((item['pk'], item['sk']) for item in items) == [(pk, i) for pk in ('a', 'b') for i in range(25)]
+
+
+@pytest.mark.unit
+def test_scan_items_filter(sorted_table):
+    items = dyn.scan_items('sorted_table', {':sk': 23}, client=sorted_table, segments=2, FilterExpression='sk > :sk')
+
+    assert sorted((item['pk'], item['sk']) for item in items) == [('a', 24), ('b', 24)]
+
+
+@pytest.mark.unit
+def test_scan_items_throttle(sorted_table):
+    start = time.monotonic()
+    items = list(dyn.scan_items('sorted_table', client=sorted_table, segments=2, items_per_second=100, Limit=10))
+
+    assert len(items) == 50
+    # the last pages of each segment are not waited for
+    assert time.monotonic() - start >= 0.25
+
+
+@pytest.mark.unit
+def test_scan_items_stops_early():
+    client = mock.MagicMock()
+    client.scan.side_effect = lambda **kwargs: {'Items': [{'id': {'S': str(kwargs['Segment'])}}],
+                                                'LastEvaluatedKey': {'id': {'S': 'next'}}}
+
+    items = dyn.scan_items('test_table', client=client, segments=2)
+    assert next(items)['id'] in ('0', '1')
+    items.close()
+    calls = client.scan.call_count
+    time.sleep(0.3)
+    assert client.scan.call_count == calls
+
+
+@pytest.mark.unit
+def test_scan_items_segment_error():
+    client = mock.MagicMock()
+    client.scan.side_effect = lambda **kwargs: ({'Items': []} if kwargs['Segment'] else _raise(ValueError('boom')))
+
+    with pytest.raises(ValueError):
+        list(dyn.scan_items('test_table', client=client, segments=2))
+
+
+def _raise(err):
+    raise err
@@ -1,14 +1,21 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+import base64
 from collections import namedtuple
+import boto3
+import gzip
 import mock
+import moto
 
 import os
 import pytest
 import simplejson as json
+import time
 
 from pyfaaster.aws.exceptions import HTTPResponseException
 import pyfaaster.aws.handlers_decorators_v2 as decs
+import pyfaaster.aws.publish as publish
+import pyfaaster.aws.request_context as request_context
 import pyfaaster.common.utils as utils
 from tests.aws.common import MockContext
 
@@ -62,6 +69,35 @@ def test_environ_aware_opts(context):
     assert not utils.deep_get(response, 'body', 'kwargs', 'FOO')
 
 
+@pytest.mark.unit
+def test_environ_aware_snapshot(context):
+    handler = decs.environ_aware(['NAMESPACE'], ['MISSING'], snapshot=True)(identity_handler)
+
+    def environ(response):
+        kwargs = utils.deep_get(response, 'body', 'kwargs')
+        return kwargs['NAMESPACE'], kwargs['MISSING']
+
+    assert environ(handler({}, None)) == ('test-ns', None)
+    os.environ['NAMESPACE'] = 'changed-ns'
+    os.environ['MISSING'] = 'found'
+    assert environ(handler({}, None)) == ('test-ns', None)
+
+    decs.refresh_environ()
+    assert environ(handler({}, None)) == ('changed-ns', 'found')
+
+
+@pytest.mark.unit
+def test_environ_aware_snapshot_missing_is_not_cached(context):
+    del os.environ['NAMESPACE']
+    handler = decs.environ_aware(['NAMESPACE'], snapshot=True)(identity_handler)
+
+    with pytest.raises(HTTPResponseException):
+        handler({}, None)
+
+    os.environ['NAMESPACE'] = 'late-ns'
+    assert utils.deep_get(handler({}, None), 'body', 'kwargs', 'NAMESPACE') == 'late-ns'
+
+
 @pytest.mark.unit
 def test_domain_aware():
     domain = 'test.com'
@@ -143,6 +179,15 @@ def test_cors_origin_not_case_sensitive(context):
         assert utils.deep_get(response, 'headers', 'Access-Control-Allow-Credentials') == 'true'
 
 
+@pytest.mark.unit
+def test_cors_origin_multi_value_headers(context):
+    event = {'multiValueHeaders': {'ORIGIN': ['https://app.cloudzero.com']}}
+    handler = decs.allow_origin_response(r'.*\.cloudzero\.com')(identity_handler)
+
+    response = handler(event, None)
+    assert utils.deep_get(response, 'headers', 'Access-Control-Allow-Origin') == 'https://app.cloudzero.com'
+
+
 @pytest.mark.unit
 def test_cors_origin_bad():
     origin = 'https://mr.robot.com'
@@ -260,6 +305,20 @@ def test_body():
     assert all([k in kwargs_body for k in body])
 
 
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', [None, 'auto', 'orjson'])
+def test_body_shared_with_handler(backend):
+    event = {'body': json.dumps({'a': 1, 'b': {'c': 2}})}
+
+    @decs.body(required=['a'], json_backend=backend)
+    def handler(event, context, body=None):
+        return body, request_context.body(event)
+
+    selected, full = handler(event, None)
+    assert selected == {'a': 1}
+    assert full == {'a': 1, 'b': {'c': 2}}
+
+
 @pytest.mark.unit
 def test_body_missing_required_key():
     body = {'a': 1, 'b': 2, 'c': 3}
@@ -429,6 +488,186 @@ def test_http_response_with_pseudo_HTTPResponseException():
     assert response['statusCode'] == expected_statuscode
 
 
+@pytest.mark.unit
+def test_http_response_compressed():
+    metrics = []
+    body = {'rows': [{'id': i, 'name': f'resource-{i}'} for i in range(100)]}
+    event = {'headers': {'Accept-Encoding': 'gzip, deflate'}}
+
+    @decs.http_response(compress_threshold=1024, metrics_hook=metrics.append)
+    def handler(e, c, **ks):
+        return {'body': body, 'headers': {'X-Test': 'yes'}}
+
+    response = handler(event, None)
+    assert response['isBase64Encoded'] is True
+    assert response['headers'] == {'X-Test': 'yes', 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}
+    assert json.loads(gzip.decompress(base64.b64decode(response['body']))) == body
+    assert metrics[0]['encoding'] == 'gzip'
+    assert metrics[0]['compressed_bytes'] < metrics[0]['original_bytes']
+    assert metrics[0]['ratio'] < 1
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('event, result', [
+    ({'headers': {'Accept-Encoding': 'gzip'}}, {'body': 'small'}),
+    ({'headers': {'Accept-Encoding': 'identity'}}, {'body': 'x' * 2048}),
+    ({}, {'body': 'x' * 2048}),
+    ({'headers': {'Accept-Encoding': 'gzip'}}, {'body': 'x' * 2048, 'headers': {'content-encoding': 'custom'}}),
+    ({'headers': {'Accept-Encoding': 'gzip'}}, {'statusCode': 204}),
+])
+def test_http_response_not_compressed(event, result):
+    @decs.http_response(compress_threshold=1024)
+    def handler(e, c, **ks):
+        return result
+
+    response = handler(event, None)
+    assert 'isBase64Encoded' not in response
+    assert response['body'] == (json.dumps(result['body']) if 'body' in result else None)
+
+
+@pytest.mark.unit
+def test_http_response_incompressible_body_not_compressed():
+    metrics = []
+
+    @decs.http_response(compress_threshold=10, metrics_hook=metrics.append)
+    def handler(e, c, **ks):
+        return {'body': base64.b64encode(os.urandom(64)).decode()}
+
+    response = handler({'headers': {'Accept-Encoding': 'gzip'}}, None)
+    assert 'isBase64Encoded' not in response
+    assert metrics[0]['ratio'] >= 1
+
+
+@pytest.mark.unit
+def test_http_response_etag():
+    @decs.http_response(etag=True)
+    def handler(e, c, **ks):
+        return {'body': {'a': 1}, 'headers': {'X-Test': 'yes'}}
+
+    response = handler({}, None)
+    assert response['statusCode'] == 200
+    tag = response['headers']['ETag']
+    assert tag.startswith('"') and tag.endswith('"')
+    assert handler({}, None)['headers']['ETag'] == tag
+
+    for if_none_match in [tag, f'W/{tag}', f'"other", {tag}', '*']:
+        not_modified = handler({'headers': {'If-None-Match': if_none_match}}, None)
+        assert not_modified == {'statusCode': 304, 'body': None, 'headers': {'X-Test': 'yes', 'ETag': tag}}
+
+    assert handler({'headers': {'If-None-Match': '"other"'}}, None) == response
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('result, expected', [
+    ({'etag': 'abc'}, '"abc"'),
+    ({'etag': 'W/"abc"'}, 'W/"abc"'),
+    ({'version': 7}, '"7"'),
+])
+def test_http_response_supplied_etag_skips_serialization(result, expected):
+    @decs.http_response(etag=True)
+    def handler(e, c, **ks):
+        return {'body': {'a': 1}, **result}
+
+    assert handler({}, None)['headers']['ETag'] == expected
+    with mock.patch.object(decs.serialization, 'dumps') as dumps:
+        response = handler({'headers': {'if-none-match': expected}}, None)
+
+    assert response['statusCode'] == 304
+    dumps.assert_not_called()
+
+
+@pytest.mark.unit
+def test_http_response_etag_only_for_ok():
+    @decs.http_response(etag=True)
+    def handler(e, c, **ks):
+        return {'body': {'a': 1}, 'statusCode': 201, 'etag': 'abc'}
+
+    response = handler({'headers': {'If-None-Match': '"abc"'}}, None)
+    assert response['statusCode'] == 201
+    assert 'ETag' not in response['headers']
+
+
+@pytest.mark.unit
+def test_http_response_etag_weak_when_compressed():
+    @decs.http_response(etag=True, compress_threshold=10)
+    def handler(e, c, **ks):
+        return {'body': 'x' * 100, 'etag': 'abc'}
+
+    response = handler({'headers': {'Accept-Encoding': 'gzip'}}, None)
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert response['headers']['ETag'] == 'W/"abc"'
+
+
+def _counting_handler(calls):
+    def handler(event, context, **kwargs):
+        calls.append(event)
+        return {'body': {'call': len(calls)}}
+    return handler
+
+
+@pytest.mark.unit
+def test_cached_response():
+    calls = []
+    handler = decs.http_response()(decs.sub_aware(decs.cached_response()(_counting_handler(calls))))
+
+    def event(sub='user-1', **query):
+        return {'queryStringParameters': query, 'requestContext': {'authorizer': {'sub': sub}}}
+
+    assert json.loads(handler(event(q='a'), None)['body']) == {'call': 1}
+    assert json.loads(handler(event(q='a'), None)['body']) == {'call': 1}
+    assert json.loads(handler(event(q='b'), None)['body']) == {'call': 2}
+    assert json.loads(handler(event('user-2', q='a'), None)['body']) == {'call': 3}
+    assert len(calls) == 3
+
+
+@pytest.mark.unit
+def test_cached_response_selected_keys_stats_and_invalidation():
+    calls = []
+    handler = decs.cached_response(querystring=['q'], key_kwargs=[])(_counting_handler(calls))
+
+    assert handler({'queryStringParameters': {'q': 'a', 'ignored': 1}}, None)['body'] == {'call': 1}
+    assert handler({'queryStringParameters': {'q': 'a', 'ignored': 2}}, None)['body'] == {'call': 1}
+    assert handler.cache_stats == {'hits': 1, 'misses': 1}
+
+    handler.cache_invalidate({'queryStringParameters': {'q': 'a'}})
+    assert handler({'queryStringParameters': {'q': 'a'}}, None)['body'] == {'call': 2}
+
+    handler.cache_clear()
+    assert handler({'queryStringParameters': {'q': 'a'}}, None)['body'] == {'call': 3}
+    assert handler.cache_stats == {'hits': 1, 'misses': 3}
+
+
+@pytest.mark.unit
+def test_cached_response_ttl_and_maxsize():
+    calls = []
+    handler = decs.cached_response(ttl=0.05, maxsize=1)(_counting_handler(calls))
+    a, b = {'pathParameters': {'id': 'a'}}, {'pathParameters': {'id': 'b'}}
+
+    handler(a, None)
+    handler(a, None)
+    handler(b, None)
+    handler(a, None)
+    assert len(calls) == 3
+
+    time.sleep(0.1)
+    handler(a, None)
+    assert len(calls) == 4
+
+
+@pytest.mark.unit
+def test_cached_response_skips_errors_and_copies():
+    responses = [{'statusCode': 404, 'body': 'nope'}, {'body': 'yes'}]
+
+    @decs.cached_response()
+    def handler(event, context, **kwargs):
+        return responses.pop(0)
+
+    assert handler({}, None)['statusCode'] == 404
+    first = handler({}, None)
+    first['headers'] = {'X-Mutated': 'yes'}
+    assert handler({}, None) == {'body': 'yes'}
+
+
 @pytest.mark.unit
 def test_scopes():
     event = {
@@ -683,3 +922,378 @@ def test_configuration_aware_generic_function(context):
         mock_conf.load.return_value = test_config
         handler()
         handler('foo', 'bar', {'x': 'y'}, test_arg_1="something", test_arg_2=0)
+
+
+@pytest.mark.unit
+def test_configuration_aware_cache_ttl(context):
+    test_config = {"test": "configuration"}
+
+    @decs.configuration_aware(CONFIG_FILE, create=True, cache_ttl=30)
+    def handler(event, context, configuration=None):
+        assert configuration['load']() == test_config
+
+    with mock.patch("pyfaaster.aws.handlers_decorators_v2.conf") as mock_conf:
+        mock_conf.load_cached.return_value = test_config
+        handler({}, None)
+        mock_conf.load_cached.assert_called_once_with(mock_conf.conn.return_value, _CONFIG_BUCKET, CONFIG_FILE,
+                                                      ttl=30, create=True)
+        mock_conf.load.assert_not_called()
+
+
+@pytest.mark.unit
+def test_configuration_aware_lazy_not_loaded(context):
+    @decs.configuration_aware(CONFIG_FILE, lazy=True)
+    def handler(event, context, configuration=None):
+        return 'no configuration needed'
+
+    with mock.patch("pyfaaster.aws.handlers_decorators_v2.conf") as mock_conf:
+        assert handler({}, None) == 'no configuration needed'
+        mock_conf.conn.assert_not_called()
+        mock_conf.load.assert_not_called()
+
+
+@pytest.mark.unit
+def test_configuration_aware_lazy_loads_once(context):
+    test_config = {"test": "configuration"}
+
+    @decs.configuration_aware(CONFIG_FILE, lazy=True)
+    def handler(event, context, configuration=None):
+        assert configuration['load']() == test_config
+        assert configuration['load']() == test_config
+
+    with mock.patch("pyfaaster.aws.handlers_decorators_v2.conf") as mock_conf:
+        mock_conf.load.return_value = test_config
+        handler({}, None)
+        mock_conf.load.assert_called_once()
+
+
+@pytest.mark.unit
+def test_configuration_aware_lazy_load_failure(context):
+    @decs.configuration_aware(CONFIG_FILE, lazy=True)
+    def handler(event, context, configuration=None):
+        return configuration['load']()
+
+    with mock.patch("pyfaaster.aws.handlers_decorators_v2.conf") as mock_conf:
+        mock_conf.load.side_effect = Exception('S3 is down')
+        with pytest.raises(HTTPResponseException) as excInfo:
+            handler({}, None)
+
+    assert excInfo.value.statusCode == 503
+
+
+@pytest.mark.unit
+def test_configuration_aware_load_after_save(context):
+    saved_config = {"test": "saved"}
+
+    @decs.configuration_aware(CONFIG_FILE)
+    def handler(event, context, configuration=None):
+        configuration['save'](saved_config)
+        return configuration['load']()
+
+    with mock.patch("pyfaaster.aws.handlers_decorators_v2.conf") as mock_conf:
+        mock_conf.load.return_value = {"test": "configuration"}
+        mock_conf.save.side_effect = lambda conn, bucket, file, settings: settings
+        assert handler({}, None) == saved_config
+
+
+@pytest.mark.unit
+def test_subscriber_claim_check(context):
+    lambda_context = MockContext('arn:aws:lambda:us-east-1:123456789012')
+    message = {'foo': 'bar' * 100000}
+
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='claim-checks')
+        claim_check = publish.claim_check('claim-checks', compress=True, client=s3)
+        conn = publish.conn('us-east-1', '123456789012', 'test', client=mock.MagicMock(), claim_check=claim_check)
+        publish.publish(conn, {'topic': message})
+        pointer = conn['sns'].publish.call_args.kwargs['Message']
+
+        event = {'Records': [{'Sns': {'TopicArn': 'arn:aws:sns:anything', 'Message': pointer}}]}
+
+        @decs.subscriber()
+        def handler(event, context, message, **kwargs):
+            return message
+
+        assert handler(event, lambda_context) == message
+
+
+def _pipeline_event(**overrides):
+    event = {
+        'headers': {'origin': 'https://example.com'},
+        'queryStringParameters': {'qp': 'q'},
+        'pathParameters': {'pp': 'p'},
+        'body': json.dumps({'bk': 'b'}),
+        'requestContext': {'authorizer': {'scopes': 'read write', 'sub': 'user-sub', 'domain': 'example.com'}},
+    }
+    event.update(overrides)
+    return event
+
+
+def _pipeline_handler(event, context, **kwargs):
+    return {'body': sorted(kwargs)}
+
+
+def _nested(handler):
+    @decs.http_response('oops')
+    @decs.allow_origin_response('.*')
+    @decs.environ_aware(['NAMESPACE'], ['MISSING'])
+    @decs.parameters(required_querystring=['qp'], path=['pp'])
+    @decs.body(required=['bk'])
+    @decs.scopes('read')
+    @decs.sub_aware
+    @decs.domain_aware
+    @decs.pausable
+    @decs.pingable
+    def wrapped(event, context, **kwargs):
+        return handler(event, context, **kwargs)
+    return wrapped
+
+
+def _compiled(handler):
+    return decs.pipeline(('http_response', ['oops']),
+                         ('allow_origin_response', ['.*']),
+                         ('environ_aware', [['NAMESPACE'], ['MISSING']]),
+                         ('parameters', [], {'required_querystring': ['qp'], 'path': ['pp']}),
+                         ('body', [], {'required': ['bk']}),
+                         ('scopes', ['read']),
+                         'sub_aware',
+                         'domain_aware',
+                         'pausable',
+                         'pingable')(handler)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('event', [
+    _pipeline_event(),
+    _pipeline_event(**{'detail-type': 'Scheduled Event', 'source': 'aws.events'}),
+    _pipeline_event(requestContext={'authorizer': {'scopes': 'write', 'sub': 'user-sub', 'domain': 'example.com'}}),
+    _pipeline_event(body='not json'),
+    _pipeline_event(queryStringParameters={}),
+])
+def test_pipeline_equivalent_to_nested(context, event):
+    lambda_context = MockContext('arn', function_name='my_func')
+    assert _compiled(_pipeline_handler)(event, lambda_context) == _nested(_pipeline_handler)(event, lambda_context)
+
+
+@pytest.mark.unit
+def test_pipeline_handler_error_equivalent_to_nested(context):
+    def failing(event, context, **kwargs):
+        raise HTTPResponseException('nope', statusCode=409)
+
+    assert _compiled(failing)(_pipeline_event(), None) == _nested(failing)(_pipeline_event(), None)
+
+
+@pytest.mark.unit
+def test_pipeline_without_http_response_raises(context):
+    handler = decs.pipeline('domain_aware')(_pipeline_handler)
+
+    with pytest.raises(HTTPResponseException):
+        handler({}, None)
+
+
+@pytest.mark.unit
+def test_pipeline_unknown_step():
+    with pytest.raises(ValueError):
+        decs.pipeline('not_a_decorator')(_pipeline_handler)
+
+
+@pytest.mark.unit
+def test_pipeline_http_response_not_first():
+    with pytest.raises(ValueError):
+        decs.pipeline('pingable', 'http_response')(_pipeline_handler)
+
+
+@pytest.mark.performance
+def test_pipeline_faster_than_nested(context):
+    import logging
+    import timeit
+
+    logging.getLogger('pyfaaster').setLevel(logging.WARNING)
+    event = _pipeline_event()
+    nested, compiled = _nested(_pipeline_handler), _compiled(_pipeline_handler)
+
+    nested_time = min(timeit.repeat(lambda: nested(event, None), number=2000, repeat=5))
+    compiled_time = min(timeit.repeat(lambda: compiled(event, None), number=2000, repeat=5))
+
+    assert compiled_time < nested_time
+
+
+@pytest.mark.unit
+def test_default_snapshot_environ(context):
+    @decs.default(snapshot_environ=True)
+    def handler(event, context, **kwargs):
+        return {'body': kwargs['NAMESPACE']}
+
+    lambda_context = MockContext('arn:aws:lambda:us-east-1:123456789012:function:my_func', function_name='my_func')
+    with mock.patch('pyfaaster.aws.handlers_decorators_v2.conf'):
+        assert json.loads(handler({}, lambda_context)['body']) == 'test-ns'
+        os.environ['NAMESPACE'] = 'changed-ns'
+        assert json.loads(handler({}, lambda_context)['body']) == 'test-ns'
+
+
+@pytest.mark.unit
+def test_snapshot_environ_keeps_pause_live(context):
+    @decs.http_response()
+    @decs.pausable
+    @decs.environ_aware(['NAMESPACE'], snapshot=True)
+    def handler(event, context, **kwargs):
+        return {'body': kwargs['NAMESPACE']}
+
+    assert handler({}, None)['statusCode'] == 200
+    os.environ['PAUSE'] = 'true'
+    assert handler({}, None)['statusCode'] == 503
+
+
+@pytest.fixture(scope='function')
+def idempotency_table():
+    with moto.mock_aws():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(TableName='idempotency',
+                            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+                            BillingMode='PAY_PER_REQUEST')
+        yield client
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('key, first, repeat, other', [
+    ('message_id',
+     {'Records': [{'Sns': {'MessageId': 'm1', 'Message': 'a'}}]},
+     {'Records': [{'Sns': {'MessageId': 'm1', 'Message': 'b'}}]},
+     {'Records': [{'Sns': {'MessageId': 'm2', 'Message': 'a'}}]}),
+    ('message_id', {'Records': [{'messageId': 'q1'}]}, {'Records': [{'messageId': 'q1'}]}, {'id': 'e1'}),
+    ('body', {'body': '{"a": 1}'}, {'body': '{"a": 1}', 'headers': {'X': 'y'}}, {'body': '{"a": 2}'}),
+    ('header:Idempotency-Key',
+     {'headers': {'Idempotency-Key': 'k1'}, 'body': 'a'},
+     {'headers': {'idempotency-key': 'k1'}, 'body': 'b'},
+     {'headers': {'Idempotency-Key': 'k2'}}),
+    (lambda event: event.get('custom'), {'custom': 1}, {'custom': 1, 'x': 2}, {'custom': 2}),
+])
+def test_idempotent(idempotency_table, key, first, repeat, other):
+    calls = []
+
+    @decs.idempotent('idempotency', key=key, client=idempotency_table)
+    def handler(event, context, **kwargs):
+        calls.append(event)
+        return {'body': {'call': len(calls)}}
+
+    assert handler(first, None) == {'body': {'call': 1}}
+    assert handler(repeat, None) == {'body': {'call': 1}}
+    assert handler(other, None) == {'body': {'call': 2}}
+    assert len(calls) == 2
+
+
+@pytest.mark.unit
+def test_idempotent_failure_is_retried(idempotency_table):
+    results = [Exception('boom'), {'body': 'ok'}]
+
+    @decs.idempotent('idempotency', client=idempotency_table)
+    def handler(event, context, **kwargs):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    event = {'id': 'e1'}
+    with pytest.raises(Exception):
+        handler(event, None)
+    assert handler(event, None) == {'body': 'ok'}
+    assert handler(event, None) == {'body': 'ok'}
+
+
+@pytest.mark.unit
+def test_idempotent_in_progress(idempotency_table):
+    responses = []
+
+    @decs.idempotent('idempotency', key='header:Idempotency-Key', client=idempotency_table)
+    def handler(event, context, **kwargs):
+        # a repeat arriving while the first request is still being handled
+        responses.append(decs.http_response()(handler)(event, context))
+        return {'body': 'first'}
+
+    assert handler({'headers': {'Idempotency-Key': 'k'}}, None) == {'body': 'first'}
+    assert responses[0]['statusCode'] == 409
+
+
+@pytest.mark.unit
+def test_idempotent_without_key(idempotency_table):
+    calls = []
+
+    @decs.idempotent('idempotency', client=idempotency_table)
+    def handler(event, context, **kwargs):
+        calls.append(event)
+        return {}
+
+    handler({}, None)
+    handler({}, None)
+    assert len(calls) == 2
+
+
+@pytest.mark.unit
+def test_idempotent_unsupported_key():
+    with pytest.raises(ValueError):
+        decs.idempotent('idempotency', key='nope')
+
+
+class LambdaContext(MockContext):
+    def __init__(self, remaining_ms):
+        super().__init__('arn:aws:lambda:us-east-1:123456789012:function:my_func', function_name='my_func')
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.mark.unit
+def test_deadline_aware():
+    @decs.deadline_aware(reserve_ms=500)
+    def handler(event, context, deadline=None):
+        return deadline, decs.deadline.current(), decs.deadline.client_config().read_timeout
+
+    kwarg, current, read_timeout = handler({}, LambdaContext(3000))
+    assert kwarg is current
+    assert 2400 < current.budget_ms() <= 2500
+    assert read_timeout == 2
+    assert decs.deadline.current() is None
+
+
+@pytest.mark.unit
+def test_deadline_aware_without_lambda_context():
+    @decs.deadline_aware()
+    def handler(event, context, deadline=None):
+        return deadline
+
+    assert handler({}, None) is None
+
+
+@pytest.mark.unit
+def test_deadline_aware_out_of_time_before_start():
+    handler = decs.http_response()(decs.deadline_aware(reserve_ms=500)(identity_handler))
+
+    assert handler({}, LambdaContext(400))['statusCode'] == 503
+
+
+@pytest.mark.unit
+def test_deadline_aware_timed_out_call():
+    @decs.http_response()
+    @decs.deadline_aware(reserve_ms=500)
+    def handler(event, context, deadline=None):
+        time.sleep(0.15)
+        raise Exception('Read timeout on endpoint URL')
+
+    assert handler({}, LambdaContext(600))['statusCode'] == 503
+    assert handler({}, LambdaContext(5000))['statusCode'] == 500
+
+
+@pytest.mark.unit
+def test_deadline_aware_interrupt():
+    @decs.http_response()
+    @decs.deadline_aware(reserve_ms=500, interrupt=True)
+    def handler(event, context, deadline=None):
+        time.sleep(2)
+        return {'body': 'too late'}
+
+    start = time.monotonic()
+    assert handler({}, LambdaContext(700))['statusCode'] == 503
+    assert time.monotonic() - start < 1
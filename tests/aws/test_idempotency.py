@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import boto3
+import mock
+import moto
+import pytest
+
+import pyfaaster.aws.idempotency as idempotency
+
+
+@pytest.fixture(scope='function')
+def dynamodb():
+    with moto.mock_aws():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(TableName='idempotency',
+                            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+                            BillingMode='PAY_PER_REQUEST')
+        yield client
+
+
+@pytest.mark.unit
+def test_begin_complete(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+
+    assert idempotency.begin(conn, 'k') == (True, None)
+    idempotency.complete(conn, 'k', {'body': {'a': [1, 2]}})
+
+    assert idempotency.begin(conn, 'k') == (False, {'body': {'a': [1, 2]}})
+    item = dynamodb.get_item(TableName='idempotency', Key={'id': {'S': 'k'}})['Item']
+    assert item['status'] == {'S': idempotency.COMPLETED}
+
+
+@pytest.mark.unit
+def test_begin_in_progress(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+
+    assert idempotency.begin(conn, 'k') == (True, None)
+    with pytest.raises(idempotency.IdempotencyInProgressException) as err:
+        idempotency.begin(conn, 'k')
+    assert err.value.statusCode == 409
+
+
+@pytest.mark.unit
+def test_begin_expired_claim(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+
+    assert idempotency.begin(conn, 'k', in_progress_ttl=-1) == (True, None)
+    assert idempotency.begin(conn, 'k') == (True, None)
+
+
+@pytest.mark.unit
+def test_release(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+
+    idempotency.begin(conn, 'k')
+    idempotency.release(conn, 'k')
+    assert idempotency.begin(conn, 'k') == (True, None)
+
+
+@pytest.mark.unit
+def test_release_keeps_completed(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+
+    idempotency.begin(conn, 'k')
+    idempotency.complete(conn, 'k', 'done')
+    idempotency.release(conn, 'k')
+    assert 'Item' in dynamodb.get_item(TableName='idempotency', Key={'id': {'S': 'k'}})
+
+
+@pytest.mark.unit
+def test_local_cache_spares_dynamodb(dynamodb):
+    conn = idempotency.conn('idempotency', client=dynamodb)
+    idempotency.begin(conn, 'k')
+    idempotency.complete(conn, 'k', 'done')
+
+    with mock.patch.object(dynamodb, 'put_item') as put_item, mock.patch.object(dynamodb, 'get_item') as get_item:
+        assert idempotency.begin(conn, 'k') == (False, 'done')
+    put_item.assert_not_called()
+    get_item.assert_not_called()
+
+
+@pytest.mark.unit
+def test_completed_elsewhere_is_cached_locally(dynamodb):
+    first = idempotency.conn('idempotency', client=dynamodb)
+    second = idempotency.conn('idempotency', client=dynamodb)
+    idempotency.begin(first, 'k')
+    idempotency.complete(first, 'k', 'done')
+
+    assert idempotency.begin(second, 'k') == (False, 'done')
+    assert second['local']['k'][1] == '"done"'
@@ -2,11 +2,30 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+import base64
+import gzip
+import json
+import os
+import time
+
 import pytest
 
 import pyfaaster.aws.kinesis as kinesis
 
 
+def _records(n, compressed=False):
+    def encode(i):
+        data = json.dumps({'i': i, 'payload': 'x' * 512}).encode()
+        return base64.b64encode(gzip.compress(data) if compressed else data)
+
+    return [{'kinesis': {'data': encode(i)}} for i in range(n)]
+
+
+def _index(s):
+    # module level, so it can be pickled for a process pool
+    return json.loads(s)['i']
+
+
 @pytest.mark.unit
 def test_decode_record_uncompressed():
     s64 = b'cGhlbm9tZW5hbCBjb3NtaWMgcG93ZXJz'
@@ -27,3 +46,99 @@ def test_decode_records_with_transform():
     records = [{'kinesis': {'data': s64}}]
     [actual] = kinesis.decode_records(records, transform_fn=lambda s: s.upper())
     assert actual == 'PHENOMENAL COSMIC POWERS'
+
+
+@pytest.mark.unit
+def test_stream_records_is_lazy():
+    s64 = b'H4sIAIoX6loC/8ssKalUSMoEkTmZZZl56QrFBYnJqQC7waqcFwAAAA=='
+    records = [{'kinesis': {'data': s64, 'sequenceNumber': str(i), 'partitionKey': f'pk-{i}'}} for i in range(3)]
+    transformed = []
+
+    def transform(s):
+        transformed.append(s)
+        return s.upper()
+
+    stream = kinesis.stream_records(records, compressed=True, transform_fn=transform)
+    assert not transformed
+
+    first = next(stream)
+    assert first == kinesis.Record('0', 'pk-0', 'ITTY BITTY LIVING SPACE')
+    assert first.partition_key == 'pk-0'
+    assert len(transformed) == 1
+
+    assert [r.sequence_number for r in stream] == ['1', '2']
+    assert len(transformed) == 3
+
+
+@pytest.mark.unit
+def test_stream_records_consumes_records_lazily():
+    def records():
+        yield {'kinesis': {'data': b'cGhlbm9tZW5hbCBjb3NtaWMgcG93ZXJz'}}
+        raise AssertionError('read past the first record')
+
+    assert next(kinesis.stream_records(records())).data == 'phenomenal cosmic powers'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_decode_records_in_parallel_preserves_order(pool):
+    records = _records(200, compressed=True)
+    assert kinesis.decode_records(records, compressed=True, transform_fn=_index, workers=2, pool=pool,
+                                  chunk_size=16) == list(range(200))
+
+
+@pytest.mark.unit
+def test_decode_records_serially_without_workers(mocker):
+    pool = mocker.patch.object(kinesis, '_pool')
+    assert kinesis.decode_records(_records(100), transform_fn=_index, chunk_size=8) == list(range(100))
+    assert kinesis.decode_records(_records(100), transform_fn=_index, workers=1, chunk_size=8) == list(range(100))
+    assert kinesis.decode_records(_records(8), transform_fn=_index, workers=4, chunk_size=8) == list(range(8))
+    pool.assert_not_called()
+
+
+@pytest.mark.unit
+def test_decode_records_reuses_pool(mocker):
+    mocker.patch.dict(kinesis._pools, clear=True)
+    kinesis.decode_records(_records(20), transform_fn=_index, workers=2, chunk_size=4)
+    pool = kinesis._pools[('thread', 2)]
+    kinesis.decode_records(_records(20), transform_fn=_index, workers=2, chunk_size=4)
+    assert kinesis._pools == {('thread', 2): pool}
+    pool.shutdown()
+
+
+@pytest.mark.unit
+def test_decode_records_falls_back_to_threads(mocker):
+    mocker.patch.dict(kinesis._pools, clear=True)
+    mocker.patch.object(kinesis, 'ProcessPoolExecutor', side_effect=OSError('no /dev/shm'))
+    assert kinesis.decode_records(_records(20), transform_fn=_index, workers=2, pool='process',
+                                  chunk_size=4) == list(range(20))
+    assert kinesis._pools[('process', 2)] is kinesis._pools[('thread', 2)]
+    kinesis._pools[('thread', 2)].shutdown()
+
+
+@pytest.mark.unit
+def test_decode_records_unsupported_pool():
+    with pytest.raises(ValueError):
+        kinesis.decode_records(_records(20), workers=2, pool='fiber', chunk_size=4)
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_decode_records_parallel_performance(pool):
+    records = _records(5000, compressed=True)
+    cpus = os.cpu_count() or 1
+
+    def timed(workers):
+        kinesis.decode_records(records[:500], compressed=True, transform_fn=_index, workers=workers, pool=pool)
+        start = time.perf_counter()
+        decoded = kinesis.decode_records(records, compressed=True, transform_fn=_index, workers=workers, pool=pool)
+        assert decoded == list(range(5000))
+        return time.perf_counter() - start
+
+    timings = {workers: timed(workers) for workers in sorted({1, 2, 4, cpus})}
+    for workers, seconds in timings.items():
+        print(f'{pool} workers={workers}: {seconds * 1000:.1f}ms')
+
+    if cpus < 2:
+        pytest.skip('scaling needs more than one cpu')
+    assert timings[max(timings)] < timings[1]
@@ -1,7 +1,12 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+import collections
+import threading
+import time
 
+import boto3
+import moto
 import pytest
 import botocore.session
 import simplejson as json
@@ -9,6 +14,7 @@ import simplejson as json
 from botocore.stub import Stubber
 
 import pyfaaster.aws.publish as pub
+import pyfaaster.common.serialization as serialization
 
 
 @pytest.mark.unit
@@ -40,8 +46,177 @@ def test_publish():
             else:
                 stubber.add_response('publish', response,
                                      {'TopicArn': topic,
-                                      'Message': json.dumps(message, iterable_as_array=True)})
+                                      'Message': serialization.dumps(message)})
 
         published_messages = pub.publish(conn, messages)
 
     assert len(published_messages) == 2
+
+
+def _events(count, topic):
+    return {topic: [{'type': 'test-event', 'detail': {'n': n, 'timestamp': 'now'}} for n in range(count)]}
+
+
+def _entries(events):
+    return [{'Id': str(i),
+             'Message': serialization.dumps(e['detail']),
+             'Subject': e['type'],
+             'MessageAttributes': {'message_type': {'DataType': 'String', 'StringValue': e['type']}}}
+            for i, e in enumerate(events)]
+
+
+@pytest.mark.unit
+def test_publish_events_batches():
+    region = 'us-east-1'
+    account_id = '123456789012'
+    topic = f'arn:aws:sns:{region}:{account_id}:system-test-topic-1'
+    events = _events(23, topic)
+
+    sns = botocore.session.get_session().create_client('sns')
+    conn = pub.conn(region, account_id, 'test', client=sns)
+    with Stubber(sns) as stubber:
+        for start in (0, 10, 20):
+            chunk = events[topic][start:start + 10]
+            stubber.add_response('publish_batch', {'Successful': [], 'Failed': []},
+                                 {'TopicArn': topic, 'PublishBatchRequestEntries': _entries(chunk)})
+
+        published = pub.publish_events(conn, events)
+        stubber.assert_no_pending_responses()
+
+    assert [e['n'] for e in published] == list(range(23))
+
+
+@pytest.mark.unit
+def test_publish_events_batch_retries_failed_entries(mocker):
+    mocker.patch.object(pub, 'BATCH_BACKOFF', 0)
+    region = 'us-east-1'
+    account_id = '123456789012'
+    topic = f'arn:aws:sns:{region}:{account_id}:system-test-topic-1'
+    events = _events(3, topic)
+    entries = _entries(events[topic])
+
+    sns = botocore.session.get_session().create_client('sns')
+    conn = pub.conn(region, account_id, 'test', client=sns)
+    with Stubber(sns) as stubber:
+        stubber.add_response('publish_batch',
+                             {'Successful': [], 'Failed': [{'Id': '1', 'Code': 'InternalError', 'SenderFault': False}]},
+                             {'TopicArn': topic, 'PublishBatchRequestEntries': entries})
+        stubber.add_response('publish_batch', {'Successful': [], 'Failed': []},
+                             {'TopicArn': topic, 'PublishBatchRequestEntries': [entries[1]]})
+
+        published = pub.publish_events(conn, events)
+        stubber.assert_no_pending_responses()
+
+    assert len(published) == 3
+
+
+@pytest.mark.unit
+def test_publish_events_batch_sender_fault():
+    region = 'us-east-1'
+    account_id = '123456789012'
+    topic = f'arn:aws:sns:{region}:{account_id}:system-test-topic-1'
+    events = _events(2, topic)
+
+    sns = botocore.session.get_session().create_client('sns')
+    conn = pub.conn(region, account_id, 'test', client=sns)
+    failed = [{'Id': '0', 'Code': 'InvalidParameter', 'SenderFault': True}]
+    with Stubber(sns) as stubber:
+        stubber.add_response('publish_batch', {'Successful': [], 'Failed': failed},
+                             {'TopicArn': topic, 'PublishBatchRequestEntries': _entries(events[topic])})
+
+        with pytest.raises(pub.PublishBatchException) as excInfo:
+            pub.publish_events(conn, events)
+
+    assert excInfo.value.failed == failed
+
+
+class RecordingSNS:
+    """ Thread safe stand-in for an SNS client that records publishes per topic. """
+
+    def __init__(self, fail_topics=()):
+        self.lock = threading.Lock()
+        self.published = collections.defaultdict(list)
+        self.fail_topics = fail_topics
+
+    def _record(self, topic_arn, messages):
+        if any(t in topic_arn for t in self.fail_topics):
+            raise Exception(f'{topic_arn} is down')
+        time.sleep(0.01)
+        with self.lock:
+            self.published[topic_arn].extend(messages)
+
+    def publish(self, TopicArn, Message, **kwargs):
+        self._record(TopicArn, [Message])
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self._record(TopicArn, [e['Message'] for e in PublishBatchRequestEntries])
+        return {'Successful': [], 'Failed': []}
+
+
+@pytest.mark.unit
+def test_publish_events_concurrently_preserves_topic_order():
+    sns = RecordingSNS()
+    conn = pub.conn('us-east-1', '123456789012', 'test', client=sns)
+    events = {}
+    for t in range(5):
+        events.update(_events(25, f'topic-{t}'))
+
+    published = pub.publish_events(conn, events, max_concurrency=3)
+
+    assert [e['n'] for e in published] == list(range(25)) * 5
+    for t in range(5):
+        messages = sns.published[f'arn:aws:sns:us-east-1:123456789012:topic-{t}']
+        assert [json.loads(m)['n'] for m in messages] == list(range(25))
+
+
+@pytest.mark.unit
+def test_publish_concurrently_collects_errors():
+    sns = RecordingSNS(fail_topics=('topic-1', 'topic-3'))
+    conn = pub.conn('us-east-1', '123456789012', 'test', client=sns)
+    messages = {f'topic-{t}': {'n': t} for t in range(5)}
+
+    with pytest.raises(pub.PublishException) as excInfo:
+        pub.publish(conn, messages, max_concurrency=5)
+
+    assert set(excInfo.value.errors) == {'topic-1', 'topic-3'}
+    assert len(sns.published) == 3
+
+
+@pytest.fixture(scope='function')
+def claim_check_bucket():
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='claim-checks')
+        yield s3
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.unit
+def test_publish_claim_check(claim_check_bucket, compress):
+    s3 = claim_check_bucket
+    sns = RecordingSNS()
+    claim_check = pub.claim_check('claim-checks', threshold=1024, compress=compress, client=s3)
+    conn = pub.conn('us-east-1', '123456789012', 'test', client=sns, claim_check=claim_check)
+    small = {'message': 'small', 'timestamp': 'now'}
+    large = {'message': 'x' * 4096, 'timestamp': 'now'}
+
+    pub.publish(conn, {'topic-small': small, 'topic-large': large})
+
+    [published_small] = sns.published['arn:aws:sns:us-east-1:123456789012:topic-small']
+    [published_large] = sns.published['arn:aws:sns:us-east-1:123456789012:topic-large']
+    assert json.loads(published_small) == small
+
+    pointer = json.loads(published_large)
+    assert pointer[pub.CLAIM_CHECK]['bucket'] == 'claim-checks'
+    assert len(published_large) < 1024
+    stored = s3.get_object(Bucket='claim-checks', Key=pointer[pub.CLAIM_CHECK]['key'])['Body'].read()
+    assert len(stored) < 4096 if compress else len(stored) > 4096
+
+    assert pub.resolve_claim_check(pointer, client=s3) == large
+
+
+@pytest.mark.unit
+def test_resolve_claim_check_passthrough():
+    message = {'foo': 'bar'}
+    assert pub.resolve_claim_check(message) is message
+    assert pub.resolve_claim_check('string message') == 'string message'
@@ -2,8 +2,10 @@
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
 import os
+import threading
+import time
+
 import pytest
-import simplejson as json
 
 import pyfaaster.aws.handlers_decorators_v2 as decs
 from czc.unittest import Context
@@ -15,6 +17,7 @@ from voluptuous import Invalid
 from tests.aws.common import MockContext
 from botocore.stub import Stubber
 import pyfaaster.aws.publish as pub
+import pyfaaster.common.serialization as serialization
 
 _CONFIG_BUCKET = 'example_config_bucket'
 
@@ -78,7 +81,7 @@ def test_publisher(context, mocker):
             else:
                 stubber.add_response('publish', response,
                                      {'TopicArn': f'arn:aws:sns:{context.region}:{context.account_id}:{topic}',
-                                      'Message': json.dumps(message, iterable_as_array=True)})
+                                      'Message': serialization.dumps(message)})
 
         test(event, context.lambda_context)
 
@@ -135,6 +138,7 @@ def test_event_publisher_sns_events(context):
 
     with Stubber(context.sns) as stubber:
         for topic, events_for_topic in events.items():
+            entries = []
             for event in events_for_topic:
                 expected_event = {
                     **event['detail']
@@ -142,9 +146,8 @@ def test_event_publisher_sns_events(context):
 
                 if 'timestamp' not in expected_event:
                     expected_event['timestamp'] = str(dt.datetime.now(tz=dt.timezone.utc))
-                stubber.add_response('publish', response, {
-                    'TopicArn': f'arn:aws:sns:{context.region}:{context.account_id}:{topic}',
-                    'Message': json.dumps(expected_event, iterable_as_array=True),
+                entries.append({
+                    'Message': serialization.dumps(expected_event),
                     'Subject': event['type'],
                     'MessageAttributes': {
                         'message_type': {
@@ -154,7 +157,18 @@ def test_event_publisher_sns_events(context):
                     }
                 })
 
+            topic_arn = f'arn:aws:sns:{context.region}:{context.account_id}:{topic}'
+            if len(entries) > 1:
+                # several events for one topic go out in a single PublishBatch
+                stubber.add_response('publish_batch', {**response, 'Successful': [], 'Failed': []}, {
+                    'TopicArn': topic_arn,
+                    'PublishBatchRequestEntries': [{'Id': str(i), **e} for i, e in enumerate(entries)],
+                })
+            else:
+                stubber.add_response('publish', response, {'TopicArn': topic_arn, **entries[0]})
+
         test(incoming_event, context.lambda_context)
+        stubber.assert_no_pending_responses()
 
 
 @pytest.mark.parametrize('events', [
@@ -194,3 +208,112 @@ def test_event_publisher_catches_bad_events(context, events):
     with Stubber(context.sns):
         with pytest.raises(Invalid):
             test(incoming_event, context.lambda_context)
+
+
+@pytest.mark.unit
+def test_publisher_options(context, mocker):
+    mock_publish = mocker.patch.object(decs.publish, 'publish')
+    messages = {'system-test-ns-topic-1': 'String Message'}
+
+    @decs.publisher(max_concurrency=4)
+    def test(event, context, **kwargs):
+        return {'messages': messages}
+
+    test({}, context.lambda_context)
+    mock_publish.assert_called_once_with(context.mock_publish_conn.return_value, messages, max_concurrency=4)
+
+
+@pytest.mark.unit
+def test_event_publisher_options(context, mocker):
+    mock_publish_events = mocker.patch.object(decs.publish, 'publish_events')
+    events = {'system-test-ns-topic-1': [{'type': 'event', 'detail': {}}]}
+
+    @decs.event_publisher(max_concurrency=4)
+    def test(event, context, **kwargs):
+        return {'events': events}
+
+    test({}, context.lambda_context)
+    mock_publish_events.assert_called_once_with(context.mock_publish_conn.return_value, events, max_concurrency=4)
+
+
+class DeadlineContext(MockContext):
+    def __init__(self, farn, remaining_ms):
+        super().__init__(farn)
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.mark.unit
+def test_publisher_deferred(context, mocker):
+    published = threading.Event()
+    reports = []
+
+    def slow_publish(conn, messages, **kwargs):
+        time.sleep(0.2)
+        published.set()
+
+    mocker.patch.object(decs.publish, 'publish', side_effect=slow_publish)
+
+    @decs.flush_publishes(on_report=reports.append)
+    def outer(event, context, **kwargs):
+        result = inner(event, context, **kwargs)
+        # the response is built while the messages are still being published
+        assert not published.is_set()
+        return result
+
+    @decs.publisher(deferred=True)
+    def inner(event, context, **kwargs):
+        return {'messages': {'topic-1': 'message'}}
+
+    outer({}, DeadlineContext(context.lambda_context.invoked_function_arn, 10000))
+    assert published.is_set()
+    assert reports == [{'published': [['topic-1']], 'failed': [], 'dropped': []}]
+
+
+@pytest.mark.unit
+def test_publisher_deferred_reports_dropped(context, mocker):
+    reports = []
+    mocker.patch.object(decs.publish, 'publish', side_effect=lambda conn, messages, **kwargs: time.sleep(0.5))
+
+    @decs.flush_publishes(reserve_ms=100, on_report=reports.append)
+    @decs.publisher(deferred=True)
+    def handler(event, context, **kwargs):
+        return {'messages': {'slow-topic': 'message'}}
+
+    started = time.monotonic()
+    handler({}, DeadlineContext(context.lambda_context.invoked_function_arn, 200))
+
+    # only the 100ms left before the reserve were spent waiting
+    assert time.monotonic() - started < 0.4
+    assert reports == [{'published': [], 'failed': [], 'dropped': [['slow-topic']]}]
+
+
+@pytest.mark.unit
+def test_publisher_deferred_failure_reported(context, mocker):
+    reports = []
+    mocker.patch.object(decs.publish, 'publish', side_effect=Exception('SNS is down'))
+
+    @decs.flush_publishes(on_report=reports.append)
+    @decs.publisher(deferred=True)
+    def handler(event, context, **kwargs):
+        return {'messages': {'topic': 'message'}}
+
+    handler({}, context.lambda_context)
+
+    [report] = reports
+    [(targets, error)] = report['failed']
+    assert targets == ['topic'] and 'SNS is down' in str(error)
+
+
+@pytest.mark.unit
+def test_publisher_deferred_without_flush_publishes_synchronously(context, mocker):
+    mock_publish = mocker.patch.object(decs.publish, 'publish')
+
+    @decs.publisher(deferred=True)
+    def handler(event, context, **kwargs):
+        return {'messages': {'topic': 'message'}}
+
+    handler({}, context.lambda_context)
+    mock_publish.assert_called_once()
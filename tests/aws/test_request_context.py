@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import threading
+
+import mock
+import pytest
+import simplejson as json
+
+import pyfaaster.aws.request_context as request_context
+import pyfaaster.common.serialization as serialization
+
+
+@pytest.mark.unit
+def test_headers_case_insensitive():
+    headers = request_context.Headers({'Origin': 'https://a.example.com', 'X-Forwarded-For': '1.2.3.4'})
+
+    assert headers['origin'] == 'https://a.example.com'
+    assert headers.get('ORIGIN') == 'https://a.example.com'
+    assert headers.get('x-forwarded-for') == '1.2.3.4'
+    assert headers.get('missing') is None
+    assert 'Origin' in headers
+    assert set(headers) == {'origin', 'x-forwarded-for'}
+    assert len(headers) == 2
+
+
+@pytest.mark.unit
+def test_headers_multi_value():
+    headers = request_context.Headers({'Accept': 'text/html'},
+                                      {'accept': ['text/html'], 'Cookie': ['a=1', 'b=2']})
+
+    assert headers['accept'] == 'text/html'
+    assert headers['cookie'] == 'b=2'
+    assert headers.get_all('COOKIE') == ['a=1', 'b=2']
+    assert headers.get_all('Accept') == ['text/html']
+    assert headers.get_all('missing') == []
+    assert len(headers) == 2
+
+
+@pytest.mark.unit
+def test_headers_single_value_only():
+    headers = request_context.Headers({'Host': 'example.com'})
+
+    assert headers.get_all('host') == ['example.com']
+
+
+@pytest.mark.unit
+def test_get_is_cached_per_event():
+    event = {'headers': {'Origin': 'o'}}
+
+    context = request_context.get(event)
+    assert request_context.get(event) is context
+    assert request_context.headers(event) is context.headers
+
+    other = {'headers': {'Origin': 'o'}}
+    assert request_context.get(other) is not context
+    assert request_context.get(other).event is other
+
+
+@pytest.mark.unit
+def test_get_is_isolated_between_threads():
+    event = {'headers': {}}
+    context = request_context.get(event)
+    contexts = []
+
+    thread = threading.Thread(target=lambda: contexts.append(request_context.get(event)))
+    thread.start()
+    thread.join()
+
+    assert contexts[0] is not context
+
+
+@pytest.mark.unit
+def test_has_headers():
+    assert request_context.get({'headers': {}}).has_headers
+    assert request_context.get({'multiValueHeaders': {'a': ['b']}}).has_headers
+    assert not request_context.get({'headers': None}).has_headers
+    assert not request_context.get({'Records': []}).has_headers
+    assert dict(request_context.headers({'headers': None})) == {}
+
+
+@pytest.mark.unit
+def test_body_parsed_once():
+    event = {'body': '{"a": 1}'}
+
+    with mock.patch('pyfaaster.common.serialization.loads', wraps=serialization.loads) as loads:
+        assert request_context.body(event) == {'a': 1}
+        assert request_context.body(event) is request_context.body(event)
+
+    loads.assert_called_once_with('{"a": 1}', backend=None)
+
+
+@pytest.mark.unit
+def test_body_invalid():
+    with pytest.raises(json.JSONDecodeError):
+        request_context.body({'body': 'nope'})
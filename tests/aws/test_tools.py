@@ -24,3 +24,17 @@ def test_setup_logging():
     log.addHandler(StreamHandler(StringIO()))
     tools.setup_logging('foo')
     tools.setup_logging('bar', level='DEBUG')
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('event, expected', [
+    ({'headers': {'User-Agent': 'curl', 'X-Forwarded-For': '1.2.3.4'}}, {'Client': 'curl', 'Source IP': '1.2.3.4'}),
+    ({'headers': {'user-agent': 'curl'}}, {'Client': 'curl', 'Source IP': 'None'}),
+    ({'multiValueHeaders': {'x-forwarded-for': ['1.2.3.4']}}, {'Client': 'None', 'Source IP': '1.2.3.4'}),
+    ({'Records': [{'eventSource': 'aws:s3'}]}, 'aws:s3'),
+    ({'Records': [{'EventSource': 'aws:sns'}]}, 'aws:sns'),
+    ({'invoked_by': 'me'}, 'me'),
+    ({}, 'invoked'),
+])
+def test_get_client_details(event, expected):
+    assert tools.get_client_details(event) == expected
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import gzip
+
+import mock
+import pytest
+
+import pyfaaster.common.compression as compression
+
+
+@pytest.fixture(autouse=True)
+def clear_negotiate_cache():
+    compression.negotiate.cache_clear()
+    yield
+    compression.negotiate.cache_clear()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('deflate, GZIP', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('br;q=0.5, gzip;q=0.8', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('*', 'br'),
+    ('*;q=0.1, br;q=0', 'gzip'),
+    ('gzip;q=bad', None),
+])
+def test_negotiate(accept_encoding, expected):
+    pytest.importorskip('brotli')
+    assert compression.negotiate(accept_encoding) == expected
+
+
+@pytest.mark.unit
+def test_negotiate_without_brotli():
+    with mock.patch.object(compression, 'brotli', None):
+        assert compression.encodings() == ('gzip',)
+        assert compression.negotiate('br, gzip;q=0.1') == 'gzip'
+        assert compression.negotiate('br') is None
+
+
+@pytest.mark.unit
+def test_compress():
+    data = b'{"a": 1}' * 100
+
+    assert gzip.decompress(compression.compress(data, 'gzip')) == data
+    with pytest.raises(ValueError):
+        compression.compress(data, 'deflate')
+
+
+@pytest.mark.unit
+def test_compress_brotli():
+    brotli = pytest.importorskip('brotli')
+    data = b'{"a": 1}' * 100
+
+    assert brotli.decompress(compression.compress(data, 'br')) == data
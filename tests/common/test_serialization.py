@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import collections
+import decimal
+import enum
+import timeit
+
+import mock
+import pytest
+import simplejson as json
+
+import pyfaaster.common.serialization as serialization
+import pyfaaster.common.utils as utils
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', ['auto', 'orjson', 'simplejson'])
+def test_loads(backend):
+    assert serialization.loads('{"a": [1, 2.5, "b", null, true]}', backend=backend) == {'a': [1, 2.5, 'b', None, True]}
+    assert serialization.loads(b'{"a": 1}', backend=backend) == {'a': 1}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', ['auto', 'orjson', 'simplejson'])
+def test_loads_invalid_raises_simplejson_error(backend):
+    with pytest.raises(json.JSONDecodeError):
+        serialization.loads('{"a": ', backend=backend)
+
+
+@pytest.mark.unit
+def test_loads_orjson_falls_back_for_unsupported_documents():
+    assert serialization.loads(f'[{2 ** 70}]', backend='orjson') == [2 ** 70]
+
+
+@pytest.mark.unit
+def test_loads_unsupported_backend():
+    with pytest.raises(ValueError):
+        serialization.loads('{}', backend='pickle')
+
+
+@pytest.mark.unit
+def test_loads_orjson_not_installed():
+    with mock.patch.object(serialization, 'orjson', None):
+        assert serialization.loads('{"a": 1}', backend='auto') == {'a': 1}
+        with pytest.raises(ValueError):
+            serialization.loads('{"a": 1}', backend='orjson')
+
+
+Row = collections.namedtuple('Row', ['id', 'tags'])
+
+
+class Color(enum.Enum):
+    RED = 'red'
+
+
+def _document():
+    return {
+        'set': {1},
+        'frozenset': frozenset(['a']),
+        'generator': (i for i in range(3)),
+        'tuple': (1, 2),
+        'namedtuple': Row(1, {'t'}),
+        'enum': Color.RED,
+        'int_decimal': decimal.Decimal('12'),
+        'float_decimal': decimal.Decimal('0.5'),
+        'unicode': 'é',
+        1: 'int key',
+        None: 'none key',
+    }
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', ['auto', 'orjson', 'simplejson'])
+def test_dumps_compatible_with_iterable_as_array(backend):
+    expected = json.loads(json.dumps(_document(), iterable_as_array=True, cls=utils.EnumEncoder))
+
+    assert json.loads(serialization.dumps(_document(), backend=backend)) == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', ['auto', 'orjson', 'simplejson'])
+def test_dumps_exact_decimals(backend):
+    document = {'generator': (i for i in range(2)), 'exact': decimal.Decimal('0.1000000000000000000001'),
+                'big': 2 ** 70}
+
+    assert serialization.dumps(document, backend=backend) == \
+        '{"generator": [0, 1], "exact": 0.1000000000000000000001, "big": 1180591620717411303424}'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('backend', ['auto', 'orjson', 'simplejson'])
+def test_dumps_unsupported(backend):
+    with pytest.raises(TypeError):
+        serialization.dumps({'object': object()}, backend=backend)
+
+
+def _report(rows, decimals=False):
+    number = decimal.Decimal if decimals else float
+    return {'rows': [{'id': f'resource-{i}', 'account': '123456789012', 'service': 'AmazonEC2',
+                      'cost': number('12.5'), 'usage': i, 'tags': {'team', 'env'}}
+                     for i in range(rows)]}
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize('name, document', [
+    ('report', _report(10000)),
+    ('dynamodb report', _report(10000, decimals=True)),
+])
+def test_dumps_benchmark(name, document):
+    timings = {backend: min(timeit.repeat(lambda: serialization.dumps(document, backend=backend), number=5, repeat=3))
+               for backend in ('simplejson', 'orjson')}
+    print(f'{name}: ' + ', '.join(f'{backend} {seconds / 5 * 1000:.1f}ms' for backend, seconds in timings.items()))
+
+    assert timings['orjson'] < timings['simplejson']